@@ -1,42 +1,18 @@
-import discord, asyncio, sys, logging, requests, traceback, re
+import discord, sys, logging, requests, traceback, re, time, typing
+from datetime import datetime, timezone
 from discord.ext import commands
 from get_image import GetImage
+from image_export import ImageExporter
 from minecraft_connector import MinecraftConnector
+from mute_scheduler import MuteScheduler
+from role_mutator import RoleMutator
+from permissions import PermissionResolver, Capability, ROLE_IDS, COLOR_ROLES, LOG_CHANNEL_ID
+from metrics import registry, MetricsServer
 
 #===================================================================================
 #=== Static definitions ============================================================
 #===================================================================================
 
-# Role and channel IDs
-MOD_ROLE_ID = 803579561362063390
-ROLE_JARI_ID = 566355710670012533
-LOG_CHANNEL_ID = 638208991587205120
-
-# Age roles
-ROLE_SS = 705783318246850812
-ROLE_DD = 703260124621570074
-ROLE_CL = 703259878206078976
-ROLE_CV = 703259629018284092
-ROLE_BB = 717611783614890006
-
-# Commodore color roles
-ROLE_COMMODORE = 1183790559324807258
-COLOR_ROLES = {
-    "grey": 1216455609709363281,
-    "purple": 1216455321396973598,
-    "yellow": 1216454050912931981,
-    "red": 1216454500425007307,
-    "cyan": 1216454226650206258,
-    "blue": 1216454278613307563,
-    "green": 1216454315015671808,
-    "pink" : 1526963750035390555
-}
-
-BOT_ADMINS = [
-    188646158636285952, # crocdent
-    202142045114990592  # goldensunboy
-]
-
 DISCORD_MESSAGE_URL_PATTERN = re.compile(
     r"^<?https://(?:(?:ptb|canary)\.)?discord(?:app)?\.com/channels/\d+/\d+/\d+(?:[/?#].*)?>?$",
     re.IGNORECASE,
@@ -47,13 +23,15 @@ DISCORD_MESSAGE_URL_PATTERN = re.compile(
 #===================================================================================
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-if not logger.hasHandlers():
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+def configure_logging():
+    logger.setLevel(logging.INFO)
+    if not logger.hasHandlers():
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+        console_handler.setFormatter(formatter)
+        logger.addHandler(console_handler)
 
 intents = discord.Intents.default()
 intents.messages = True
@@ -65,23 +43,75 @@ token_file = 'prod-token.txt'
 if len(sys.argv) == 2:
     token_file = sys.argv[1] # Allow token file override E.G. running against a PPE env
 
-bot = commands.Bot(command_prefix='a!', intents=intents, help_command=None)
-
-get_img = GetImage(logger)
-mc_connector = MinecraftConnector(bot, logger)
+class AkagiBot(commands.Bot):
+    async def setup_hook(self):
+        await metrics_server.start()
+        await mute_scheduler.start()
+        await mc_connector.start()
+
+    async def close(self):
+        await mute_scheduler.stop()
+        await mc_connector.stop()
+        await image_exporter.close()
+        await get_img.close()
+        await metrics_server.stop()
+        await super().close()
+
+bot = AkagiBot(command_prefix='a!', intents=intents, help_command=None)
+
+# The services the commands use (get_img, image_exporter, role_mutator, permissions, metrics_server, mc_connector
+# and mute_scheduler) are only created when the bot is run, at the bottom of this file
+# Image processing workers are spawned processes that import this script, and must not start a second bot
+
+# Runs the unmute for an expired mute, the mute scheduler's callback
+async def unmute_member(entry: dict):
+    await bot.wait_until_ready()
+    guild = bot.get_guild(entry["guild_id"])
+    if guild is None:
+        logger.warning(f"Dropping pending unmute of {entry['member_name']}, the bot is no longer in guild ID {entry['guild_id']}")
+        return
+    member = guild.get_member(entry["member_id"])
+    if member is None:
+        logger.info(f"Dropping pending unmute of {entry['member_name']}, they have left the server")
+        return
+    mute_role = discord.utils.get(guild.roles, name="Muted")
+    await role_mutator.edit_roles(member, remove=[mute_role], reason="Mute expired")
+    # The unmute is done at this point, a failure to log it must not make the scheduler retry it
+    log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    if not log_channel:
+        logger.error(f"Could not find log channel with ID {LOG_CHANNEL_ID}")
+        return
+    try:
+        await log_channel.send(f"{member.name} has been unmuted.")
+    except discord.HTTPException as e:
+        logger.error(f"Could not log the unmute of {member.name}: {e!r}")
 
 #===================================================================================
 #=== Core command code =============================================================
 #===================================================================================
 
+command_seconds = registry.histogram("akagi_command_duration_seconds", "Time spent running bot commands", ["command"])
+command_errors = registry.counter("akagi_command_errors_total", "Bot commands that raised an error", ["command"])
+
 class LoggingWrapper(commands.Command):
     async def invoke(self, ctx):
         logger.info(f"User {ctx.author} invoked command '{ctx.message.content}'")
+        start = time.perf_counter()
         try:
+            # DM-only commands ignore guild messages silently, without saying whether the user could have used them
+            if self.extras.get("dm_only") and ctx.guild is not None:
+                return
+            denied = permissions.check_command(ctx.author, self.name)
+            if denied is not None:
+                await ctx.send(denied)
+                return
             await super().invoke(ctx)
         except Exception as e:
+            command_errors.inc(command=self.name)
             st = traceback.format_exc()
             await ctx.send(f"Oh dear, Shikikan-sama... I seem to have tripped while trying to service your request. I'm so sorry! Here are some details which might be of use:\n```{e}\n{st}```")
+        finally:
+            command_seconds.observe(time.perf_counter() - start, command=self.name)
 
 @bot.event
 async def on_ready():
@@ -89,6 +119,7 @@ async def on_ready():
 
 @bot.event
 async def on_message(message: discord.Message):
+    get_img.index.add_message(message)
     if message.author.bot:
         return
 
@@ -97,36 +128,64 @@ async def on_message(message: discord.Message):
     if content.startswith(".iam jari squad"):
         await handle_jari_command(message)
     elif content.startswith(".iamnot jari squad") or content.startswith(".iamn jari squad"):
-        role = message.guild.get_role(ROLE_JARI_ID)
-        await message.author.remove_roles(role)
+        await role_mutator.edit_roles(message.author, remove=[ROLE_IDS["jari"]])
         await message.channel.send("Your Jari role has been removed, Shikikan.")
 
     await bot.process_commands(message)
 
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    get_img.on_message_edit(payload.message)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    get_img.on_messages_deleted(payload.channel_id, [payload.message_id])
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    get_img.on_messages_deleted(payload.channel_id, payload.message_ids)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    get_img.resolver.on_channel_deleted(channel.id)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    permissions.invalidate_member(after.guild.id, after.id)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    permissions.invalidate_member(member.guild.id, member.id)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    permissions.invalidate_guild(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    permissions.invalidate_guild(role.guild.id)
+
+@bot.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    get_img.resolver.on_channel_deleted(payload.thread_id)
+
 async def handle_jari_command(message: discord.Message):
     member = message.author
-    roles = member.roles
-    guild = message.guild
-    jari_role = guild.get_role(ROLE_JARI_ID)
 
-    if any(role.id in [ROLE_CL, ROLE_CV, ROLE_BB] for role in roles):
-        await member.add_roles(jari_role)
+    if permissions.has(member, Capability.AGE_ADULT):
+        await role_mutator.edit_roles(member, add=[ROLE_IDS["jari"]])
         await message.channel.send("Looks like you are old enough Shikikan, here is your Jari role.")
-    elif any(role.id in [ROLE_DD, ROLE_SS] for role in roles):
+    elif permissions.has(member, Capability.AGE_MINOR):
         await message.channel.send("Sorry Shikikan, you aren't old enough. Atago may be interested in you, though...")
     else:
         await message.channel.send("Sorry Shikikan, but you don't have the age role yet. Complete the birthyear form, or wait if you have.")
 
 @bot.command(cls=LoggingWrapper)
 async def help(ctx: commands.Context):
-    await ctx.send("My current commands are: mute, color")
+    await ctx.send("My current commands are: mute, mutes, unmute, color, export")
 
 @bot.command(cls=LoggingWrapper)
 async def mute(ctx: commands.Context, member: discord.Member = None, minutes: int = None):
-    if not (ctx.author.guild_permissions.administrator or MOD_ROLE_ID in [role.id for role in ctx.author.roles]):
-        await ctx.send("Sorry Shikikan, but you aren't allowed to use this command.")
-        return
-
     if not member or not minutes:
         await ctx.send("Shikikan, you need to mention a user and provide a duration!")
         return
@@ -136,22 +195,43 @@ async def mute(ctx: commands.Context, member: discord.Member = None, minutes: in
         return
 
     mute_role = discord.utils.get(ctx.guild.roles, name="Muted")
-    await member.add_roles(mute_role)
+    await role_mutator.edit_roles(member, add=[mute_role], reason=f"Muted by {ctx.author.name}")
+    mute_scheduler.schedule(ctx.guild.id, member.id, member.name, ctx.author.name, minutes)
     await ctx.send(f"Fufufu~ The troublemaker has been muted for {minutes} minute(s) as instructed, Shikikan~")
     log_channel = bot.get_channel(LOG_CHANNEL_ID)
     await log_channel.send(f"{member.name} has been muted for {minutes} minutes by moderator {ctx.author.name}.")
 
-    await asyncio.sleep(minutes * 60)
-    await member.remove_roles(mute_role)
-    await log_channel.send(f"{member.name} has been unmuted.")
+@bot.command(cls=LoggingWrapper)
+async def mutes(ctx: commands.Context):
+    pending = mute_scheduler.list_pending(ctx.guild.id)
+    if not pending:
+        await ctx.send("Nobody is muted right now, Shikikan. How peaceful~")
+        return
+    lines = [f"{entry['member_name']}, muted by {entry['moderator_name']}, unmuted <t:{int(entry['due_at'])}:R>" for entry in pending[:20]]
+    if len(pending) > 20:
+        lines.append(f"...and {len(pending) - 20} more")
+    await ctx.send("Shikikan, these troublemakers are still muted:\n" + "\n".join(lines))
 
 @bot.command(cls=LoggingWrapper)
-async def color(ctx: commands.Context, color_name: str = None):
-    member = ctx.author
-    if ROLE_COMMODORE not in [role.id for role in member.roles]:
-        await ctx.send("Sorry Shikikan, but only Commodore can change color.")
+async def unmute(ctx: commands.Context, member: discord.Member = None):
+    if not member:
+        await ctx.send("Shikikan, you need to mention a user!")
+        return
+
+    if mute_scheduler.get(ctx.guild.id, member.id) is None:
+        await ctx.send("Shikikan, that user isn't muted.")
         return
+    mute_role = discord.utils.get(ctx.guild.roles, name="Muted")
+    await role_mutator.edit_roles(member, remove=[mute_role], reason=f"Unmuted by {ctx.author.name}")
+    # Only forget the pending unmute once the role is gone, so a failed edit leaves it to the scheduler
+    mute_scheduler.cancel(ctx.guild.id, member.id)
+    await ctx.send("Very well Shikikan, I have lifted their mute early.")
+    log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    await log_channel.send(f"{member.name} has been unmuted early by moderator {ctx.author.name}.")
 
+@bot.command(cls=LoggingWrapper)
+async def color(ctx: commands.Context, color_name: str = None):
+    member = ctx.author
     if not color_name:
         await ctx.send("Shikikan, you need to tell me which color you want.")
         return
@@ -161,24 +241,12 @@ async def color(ctx: commands.Context, color_name: str = None):
         await ctx.send("Sorry Shikikan, I do not recognize that color.")
         return
 
-    # Remove all color roles
-    for role_id in COLOR_ROLES.values():
-        role = ctx.guild.get_role(role_id)
-        await member.remove_roles(role)
-
-    # Add selected color role
-    new_role = ctx.guild.get_role(COLOR_ROLES[color_name])
-    await member.add_roles(new_role)
+    # Swap out any other color role for the selected one in a single edit
+    await role_mutator.edit_roles(member, add=[COLOR_ROLES[color_name]], remove=COLOR_ROLES.values())
     await ctx.send("There you go Shikikan, you look great in that color!")
 
-@bot.command(cls=LoggingWrapper)
+@bot.command(cls=LoggingWrapper, extras={"dm_only": True}) # this command can only be used in a DM
 async def host(ctx: commands.Context):
-    if ctx.guild is not None:
-        return # this command can only be used in a DM
-    if ctx.author.id not in BOT_ADMINS:
-        await ctx.send("Sorry Shikikan, but you aren't allowed to use this command.")
-        return
-    
     response = requests.get("https://api.ipify.org/")
     if response.status_code == 200:
         ip = response.text
@@ -199,6 +267,26 @@ async def get(ctx: commands.Context, arg = None):
         else:
             await ctx.send("Shikikan, I don't understand your request.")
 
+# Parse a YYYY-MM-DD date as midnight UTC, or None if it is not one
+def parse_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+@bot.command(cls=LoggingWrapper)
+async def export(ctx: commands.Context, channel: typing.Optional[discord.TextChannel] = None, after: str = None, before: str = None):
+    channel = channel or ctx.channel
+    after_date = parse_date(after) if after else None
+    before_date = parse_date(before) if before else None
+    if (after and after_date is None) or (before and before_date is None):
+        await ctx.send("Shikikan, dates need to look like 2024-12-31.")
+        return
+    if after_date and before_date and after_date >= before_date:
+        await ctx.send("Shikikan, the first date needs to be before the second one.")
+        return
+    await image_exporter.export(ctx, channel, after_date, before_date)
+
 #===================================================================================
 #=== Run the bot ===================================================================
 #===================================================================================
@@ -211,5 +299,15 @@ def load_token(filepath=token_file):
     except FileNotFoundError:
         logger.error(f"Error: File '{filepath}' not found.")
 
-# Replace with your bot token
-bot.run(load_token())
\ No newline at end of file
+if __name__ == "__main__":
+    configure_logging()
+    get_img = GetImage(logger)
+    image_exporter = ImageExporter(logger, get_img)
+    role_mutator = RoleMutator(logger)
+    permissions = PermissionResolver(logger)
+    metrics_server = MetricsServer(logger)
+    mc_connector = MinecraftConnector(bot, logger)
+    mute_scheduler = MuteScheduler(logger, unmute_member)
+
+    # Replace with your bot token
+    bot.run(load_token())
\ No newline at end of file
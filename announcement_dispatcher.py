@@ -0,0 +1,188 @@
+import time, random, asyncio
+from collections import deque
+from logging import Logger
+
+# HTTP statuses for which sending the same text again cannot succeed: missing permissions, unknown channel
+UNDELIVERABLE_STATUS_CODES = {403, 404}
+
+# Outcomes of delivering a line
+DELIVERED = "delivered"
+RETRY_LATER = "retry later"     # still failing after max_attempts sends, the caller has to offer it again
+UNDELIVERABLE = "undeliverable" # sending it again cannot succeed
+
+class UndeliverableError(Exception):
+    '''
+    Raised by a send function when retrying cannot help, such as when the channel does not exist
+    '''
+
+class PendingAnnouncement:
+    def __init__(self, text: str, future: asyncio.Future):
+        self.text = text
+        self.future = future # resolved with the outcome once the text has been delivered or handed back
+        self.enqueued_at = time.monotonic()
+
+class AnnouncementDispatcher:
+    '''
+    Outbound queue of announcement lines, delivered to Discord channels by one worker task per channel
+      Lines queued close together are packed into as few messages as fit under max_message_chars
+      A failed send is retried with the same lines, backing off exponentially, or for as long as Discord asks
+      when it reports a rate limit, which does not count as a failed attempt
+      After max_attempts failed sends the lines are handed back for the caller to offer again later, and they
+      are dropped at once when the send raises UndeliverableError or an HTTP 403 or 404, so neither an outage
+      nor a misconfigured channel holds up a caller forever
+      Sends to the same channel are spaced at least min_send_interval_seconds apart
+      send: async (channel ID, text) -> bool, False or an exception means the text was not delivered
+    '''
+    def __init__(self, logger: Logger, send, prefix: str = "", max_message_chars: int = 2000, coalesce_seconds: float = 0.5,
+                 min_send_interval_seconds: float = 1, max_retry_seconds: float = 60, max_attempts: int = 8):
+        self.logger = logger
+        self.send = send
+        self.prefix = prefix
+        self.max_message_chars = max_message_chars
+        self.coalesce_seconds = coalesce_seconds
+        self.min_send_interval_seconds = min_send_interval_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.max_attempts = max_attempts
+        self.queues = {}  # channel ID -> deque of PendingAnnouncement, oldest first
+        self.wakeups = {} # channel ID -> event set when lines are queued
+        self.workers = {} # channel ID -> worker task
+        self.messages_sent = 0
+        self.lines_delivered = 0
+        self.send_failures = 0
+        self.lines_deferred = 0
+        self.lines_dropped = 0
+        self.total_latency_seconds = 0
+        self.max_latency_seconds = 0
+
+    '''
+    Queue lines for a channel and wait until every one of them has been delivered or given up on
+    Returns RETRY_LATER if any line was handed back, otherwise UNDELIVERABLE if any was dropped, otherwise DELIVERED
+    '''
+    async def deliver(self, channel_id: int, lines: list) -> str:
+        if len(lines) == 0:
+            return DELIVERED
+        loop = asyncio.get_running_loop()
+        pending = [PendingAnnouncement(line, loop.create_future()) for line in lines]
+        if channel_id not in self.workers:
+            self.queues[channel_id] = deque()
+            self.wakeups[channel_id] = asyncio.Event()
+            self.workers[channel_id] = asyncio.create_task(self.run_worker(channel_id), name=f"announcements-{channel_id}")
+        self.queues[channel_id].extend(pending)
+        self.wakeups[channel_id].set()
+        outcomes = set(await asyncio.gather(*[p.future for p in pending]))
+        for outcome in (RETRY_LATER, UNDELIVERABLE):
+            if outcome in outcomes:
+                return outcome
+        return DELIVERED
+
+    async def run_worker(self, channel_id: int):
+        queue = self.queues[channel_id]
+        wakeup = self.wakeups[channel_id]
+        failures = 0
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                # Give the rest of a burst a moment to arrive so it goes out in one message
+                await asyncio.sleep(self.coalesce_seconds)
+
+            batch = self.pack(queue)
+            text = self.prefix + "\n".join(p.text for p in batch)
+            retry_after = None
+            undeliverable = False
+            try:
+                delivered = await self.send(channel_id, text)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Failed to send announcement to channel ID {channel_id}: {e!r}")
+                delivered = False
+                # discord.RateLimited and 429 responses say how long to wait
+                retry_after = getattr(e, "retry_after", None)
+                undeliverable = isinstance(e, UndeliverableError) or getattr(e, "status", None) in UNDELIVERABLE_STATUS_CODES
+
+            if not delivered:
+                self.send_failures += 1
+                if retry_after is None:
+                    failures += 1
+                if undeliverable:
+                    self.logger.error(f"Dropping {len(batch)} announcements for channel ID {channel_id}, they cannot be delivered: {[p.text for p in batch]}")
+                    self.finish(queue, batch, UNDELIVERABLE)
+                    self.lines_dropped += len(batch)
+                    failures = 0
+                    continue
+                if failures >= self.max_attempts:
+                    self.logger.error(f"Handing back {len(batch)} announcements for channel ID {channel_id} after {failures} failed attempts")
+                    self.finish(queue, batch, RETRY_LATER)
+                    self.lines_deferred += len(batch)
+                    failures = 0
+                    continue
+                # The batch stays at the front of the queue, so it is sent again, possibly with more lines packed in
+                delay = retry_after if retry_after is not None else random.uniform(0, min(self.max_retry_seconds, 2 ** failures))
+                self.logger.warning(f"Retrying {len(batch)} announcements for channel ID {channel_id} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+            now = time.monotonic()
+            for p in batch:
+                latency = now - p.enqueued_at
+                self.total_latency_seconds += latency
+                self.max_latency_seconds = max(self.max_latency_seconds, latency)
+            self.finish(queue, batch, DELIVERED)
+            self.messages_sent += 1
+            self.lines_delivered += len(batch)
+            await asyncio.sleep(self.min_send_interval_seconds)
+
+    # Remove a batch from the front of the queue and tell whoever is waiting on it what became of it
+    def finish(self, queue: deque, batch: list, outcome: str):
+        for _ in batch:
+            queue.popleft()
+        for p in batch:
+            if not p.future.done():
+                p.future.set_result(outcome)
+
+    '''
+    Take as many lines from the front of the queue as fit in one message, without removing them
+    A line too long to fit in a message on its own is truncated
+    '''
+    def pack(self, queue: deque) -> list:
+        batch = []
+        length = len(self.prefix)
+        for p in queue:
+            if len(p.text) > self.max_message_chars - len(self.prefix):
+                p.text = p.text[:self.max_message_chars - len(self.prefix) - 1] + "…"
+            added = len(p.text) + (1 if batch else 0)
+            if batch and length + added > self.max_message_chars:
+                break
+            batch.append(p)
+            length += added
+        return batch
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_depth": sum(len(queue) for queue in self.queues.values()),
+            "messages_sent": self.messages_sent,
+            "lines_delivered": self.lines_delivered,
+            "send_failures": self.send_failures,
+            "lines_deferred": self.lines_deferred,
+            "lines_dropped": self.lines_dropped,
+            "average_latency_seconds": round(self.total_latency_seconds / self.lines_delivered, 3) if self.lines_delivered else None,
+            "max_latency_seconds": round(self.max_latency_seconds, 3)
+        }
+
+    '''
+    Cancel the workers, anything still queued was never acknowledged and will be fetched again after a restart
+    '''
+    async def stop(self):
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queue in self.queues.values():
+            for p in queue:
+                if not p.future.done():
+                    p.future.cancel()
+        self.workers.clear()
+        self.queues.clear()
+        self.wakeups.clear()
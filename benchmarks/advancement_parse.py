@@ -0,0 +1,52 @@
+'''
+Compare the selective advancement parser against a full json.load of each file
+Usage (from the repository root): python -m benchmarks.advancement_parse --players 200 --repeat 5
+'''
+import os, sys, json, time, argparse, tempfile
+
+from minecraft_connector import parse_announced_advancements, announcement_whitelist, advancements_to_mask
+from benchmarks.synthetic_world import generate_world
+
+def full_parse(path: str) -> int:
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return advancements_to_mask(k for k in data if k in announcement_whitelist and data[k].get("done", False))
+
+def time_parser(parser, paths: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            parser(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--recipes", type=int, default=1200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as minecraft_home:
+        uuids = generate_world(minecraft_home, players=args.players, recipes=args.recipes)
+        advancements_dir = os.path.join(minecraft_home, "world", "advancements")
+        paths = [os.path.join(advancements_dir, f"{u}.json") for u in uuids]
+
+        for path in paths:
+            if full_parse(path) != parse_announced_advancements(path):
+                sys.exit(f"Parsers disagree on {path}")
+
+        full_seconds = time_parser(full_parse, paths, args.repeat)
+        selective_seconds = time_parser(parse_announced_advancements, paths, args.repeat)
+        print(json.dumps({
+            "benchmark": "advancement_parse",
+            "players": args.players,
+            "average_file_bytes": sum(os.path.getsize(p) for p in paths) // len(paths),
+            "full_parse_seconds": round(full_seconds, 4),
+            "selective_parse_seconds": round(selective_seconds, 4),
+            "speedup": round(full_seconds / selective_seconds, 2)
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
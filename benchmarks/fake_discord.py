@@ -0,0 +1,82 @@
+'''
+Stand-ins for the parts of discord.py that GetImage touches, and a local HTTP server to download images from
+'''
+import os, random, asyncio
+from types import SimpleNamespace
+from aiohttp import web
+
+class FakeChannel:
+    def __init__(self, channel_id: int, messages: list):
+        self.id = channel_id
+        self.messages = messages # newest first, like history(oldest_first=False)
+        self.history_calls = 0
+
+    async def history(self, limit: int = 100, oldest_first: bool = False):
+        self.history_calls += 1
+        for msg in self.messages[:limit]:
+            yield msg
+
+class FakeContext:
+    def __init__(self, channel: FakeChannel, filesize_limit: int = 25 * 1024 * 1024):
+        self.channel = channel
+        self.guild = SimpleNamespace(id=1, filesize_limit=filesize_limit)
+        self.author = SimpleNamespace(id=2, name="benchmark")
+        self.sent = [] # (content, number of files) for every message the bot sent
+
+    async def send(self, content: str = None, files: list = None, **kwargs):
+        self.sent.append((content, len(files or [])))
+        message_id = 10 ** 6 + len(self.sent)
+        attachments = [SimpleNamespace(url=f"https://cdn.example/attachments/{message_id}/{f.filename}") for f in files or []]
+        return SimpleNamespace(id=message_id, jump_url=f"https://discord.example/channels/1/{self.channel.id}/{message_id}", attachments=attachments)
+
+'''
+A message with one image attachment, or no attachments if url is None
+'''
+def fake_message(message_id: int, channel: FakeChannel, url: str = None):
+    attachments = []
+    if url is not None:
+        attachments.append(SimpleNamespace(url=url, filename=os.path.basename(url), content_type="image/png"))
+    return SimpleNamespace(id=message_id, channel=channel, embeds=[], attachments=attachments, content="")
+
+'''
+Build a channel whose history holds `messages` messages, every `image_every`th of which has an image on the server
+'''
+def fake_channel(server_url: str, messages: int = 200, image_every: int = 3, channel_id: int = 1000) -> FakeChannel:
+    channel = FakeChannel(channel_id, [])
+    for i in range(messages, 0, -1):
+        url = f"{server_url}/images/{i}.png" if i % image_every == 0 else None
+        channel.messages.append(fake_message(i, channel, url))
+    return channel
+
+class ImageServer:
+    '''
+    Local HTTP server answering /images/<name> with deterministic random bytes of image_bytes length
+    An optional delay simulates CDN latency
+    '''
+    def __init__(self, image_bytes: int = 512 * 1024, delay_seconds: float = 0, host: str = "127.0.0.1", port: int = 0):
+        self.image_bytes = image_bytes
+        self.delay_seconds = delay_seconds
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.runner = None
+
+    async def handle_image(self, request):
+        self.requests += 1
+        if self.delay_seconds > 0:
+            await asyncio.sleep(self.delay_seconds)
+        rng = random.Random(request.match_info["name"])
+        return web.Response(body=rng.randbytes(self.image_bytes), content_type="image/png")
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/images/{name}", self.handle_image)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return f"http://{self.host}:{self.port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,78 @@
+'''
+Measure how many oversized images per second the image processor can shrink, for each process pool size,
+and the longest the event loop was stalled meanwhile
+Usage (from the repository root): python -m benchmarks.image_transcode --images 16 --width 3000 --height 2000
+'''
+import io, os, sys, json, time, logging, asyncio, argparse, discord
+
+from image_processing import ImageProcessor, Image
+
+def make_image(width: int, height: int) -> bytes:
+    # Noise compresses poorly, so a PNG of it is about as big as an image of that size gets
+    noise = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    out = io.BytesIO()
+    noise.save(out, "PNG")
+    return out.getvalue()
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    worst = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+async def run(images: list, max_bytes: int, workers: int) -> dict:
+    processor = ImageProcessor(logging.getLogger("benchmark"), max_concurrency=workers, max_workers=workers)
+    # Start the workers before timing, spawning them is a one-off cost
+    await asyncio.get_running_loop().run_in_executor(processor.get_executor(), abs, 0)
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(processor.prepare(io.BytesIO(data), max_bytes) for data in images))
+    seconds = time.perf_counter() - start
+    stop.set()
+    max_lag = await lag_task
+    processor.close()
+    # Shrunk images are uploaded as discord.File, which takes anything but a real file object for a path
+    for fp, extension in results:
+        if fp is not None:
+            discord.File(fp, filename=f"image.{extension}").close()
+            fp.close()
+    return {
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "images_per_second": round(len(images) / seconds, 2),
+        "images_per_second_per_worker": round(len(images) / seconds / workers, 2),
+        "max_loop_lag_seconds": round(max_lag, 4),
+        "failed": sum(1 for fp, _ in results if fp is None)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024, help="upload limit the images are shrunk to")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if Image is None:
+        sys.exit("Pillow is required for this benchmark")
+
+    images = [make_image(args.width, args.height) for _ in range(args.images)]
+    runs = []
+    workers = 1
+    while workers <= args.max_workers:
+        runs.append(asyncio.run(run(images, args.max_bytes, workers)))
+        workers *= 2
+    print(json.dumps({
+        "benchmark": "image_transcode",
+        "images": args.images,
+        "average_source_bytes": sum(len(data) for data in images) // len(images),
+        "max_bytes": args.max_bytes,
+        "cpu_count": os.cpu_count(),
+        "runs": runs
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
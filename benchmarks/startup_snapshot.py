@@ -0,0 +1,55 @@
+'''
+Compare server startup with no baseline snapshot against startup from a snapshot with a fraction of files changed
+Usage (from the repository root): python -m benchmarks.startup_snapshot --players 1000 --changed 0.01
+'''
+import os, json, time, logging, argparse, tempfile
+
+from minecraft_connector import MinecraftConnectorServer
+from benchmarks.synthetic_world import generate_world
+
+def start_server(minecraft_home: str, workdir: str) -> float:
+    props = {
+        "minecraft_home": minecraft_home,
+        "minecraft_world_name": "world",
+        "auth_token": "benchmark",
+        "update_interval_seconds": 24 * 60 * 60, # Keep the background tick out of the measurement
+        "message_log_path": os.path.join(workdir, "messages.jsonl"),
+        "snapshot_path": os.path.join(workdir, "snapshot.json")
+    }
+    start = time.perf_counter()
+    server = MinecraftConnectorServer(logging.getLogger("benchmark"), props)
+    seconds = time.perf_counter() - start
+    if server.parse_executor is not None:
+        server.parse_executor.shutdown()
+    return seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--recipes", type=int, default=1200)
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of advancement files touched between restarts")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as minecraft_home, tempfile.TemporaryDirectory() as workdir:
+        uuids = generate_world(minecraft_home, players=args.players, recipes=args.recipes)
+        advancements_dir = os.path.join(minecraft_home, "world", "advancements")
+
+        cold_seconds = start_server(minecraft_home, workdir)
+
+        changed = uuids[:int(len(uuids) * args.changed)]
+        now_ns = time.time_ns()
+        for player_uuid in changed:
+            os.utime(os.path.join(advancements_dir, f"{player_uuid}.json"), ns=(now_ns, now_ns))
+        warm_seconds = start_server(minecraft_home, workdir)
+
+        print(json.dumps({
+            "benchmark": "startup_snapshot",
+            "players": args.players,
+            "changed_files": len(changed),
+            "cold_start_seconds": round(cold_seconds, 4),
+            "snapshot_start_seconds": round(warm_seconds, 4),
+            "speedup": round(cold_seconds / warm_seconds, 2)
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
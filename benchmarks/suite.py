@@ -0,0 +1,119 @@
+'''
+Offline benchmark suite for the Minecraft connector server and the image commands, printing JSON results
+Usage (from the repository root): python -m benchmarks.suite --players 500 --images 10 > results.json
+'''
+import os, sys, json, time, logging, asyncio, argparse, tempfile
+
+from minecraft_connector import MinecraftConnectorServer
+from get_image import GetImage
+from benchmarks.synthetic_world import generate_world
+from benchmarks.fake_discord import FakeContext, ImageServer, fake_channel
+
+def timed(fn, *args, repeat: int = 1) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return round(best, 4)
+
+async def timed_async(fn, *args) -> float:
+    start = time.perf_counter()
+    await fn(*args)
+    return round(time.perf_counter() - start, 4)
+
+def bench_connector(args, workdir: str) -> dict:
+    minecraft_home = os.path.join(workdir, "minecraft")
+    uuids = generate_world(minecraft_home, players=args.players, late_game=args.late_game, recipes=args.recipes)
+    advancements_dir = os.path.join(minecraft_home, "world", "advancements")
+    props = {
+        "minecraft_home": minecraft_home,
+        "minecraft_world_name": "world",
+        "auth_token": "benchmark",
+        "update_interval_seconds": 24 * 60 * 60, # Keep the background tick out of the measurement
+        "parse_workers": args.parse_workers,
+        "message_log_path": os.path.join(workdir, "messages.jsonl"),
+        "snapshot_path": os.path.join(workdir, "snapshot.json"),
+        "max_buffered_messages": args.messages
+    }
+    server = MinecraftConnectorServer(logging.getLogger("benchmark"), props)
+    results = {"players": args.players, "average_file_bytes": sum(os.path.getsize(os.path.join(advancements_dir, f"{u}.json")) for u in uuids) // len(uuids)}
+
+    os.remove(props["snapshot_path"])
+    results["initial_cold_seconds"] = timed(server.get_initial_advancement_messages)
+    results["initial_snapshot_seconds"] = timed(server.get_initial_advancement_messages)
+    results["tick_idle_seconds"] = timed(server.get_new_advancement_messages, repeat=args.repeat)
+
+    changed = uuids[:max(1, int(len(uuids) * args.changed))]
+    def touch_and_tick():
+        now_ns = time.time_ns()
+        for player_uuid in changed:
+            os.utime(os.path.join(advancements_dir, f"{player_uuid}.json"), ns=(now_ns, now_ns))
+        server.get_new_advancement_messages()
+    results["tick_changed_files"] = len(changed)
+    results["tick_changed_seconds"] = timed(touch_and_tick, repeat=args.repeat)
+
+    for i in range(args.messages):
+        server.message_log.append(f"Player{i} has made the advancement **[Benchmark]**")
+    def fetch_all(after):
+        while True:
+            entries = server.fetch_messages(0, after)
+            if not entries:
+                break
+            after = entries[-1][0]
+    results["fetch_messages"] = args.messages
+    results["fetch_cursor_seconds"] = timed(fetch_all, 0, repeat=args.repeat)
+    results["fetch_ack_seconds"] = timed(lambda: [server.fetch_messages(0) for _ in range(args.messages // 100 + 1)])
+    if server.parse_executor is not None:
+        server.parse_executor.shutdown()
+    return results
+
+async def bench_images(args, workdir: str) -> dict:
+    image_server = ImageServer(image_bytes=args.image_bytes, delay_seconds=args.delay)
+    server_url = await image_server.start()
+    get_img = GetImage(logging.getLogger("benchmark"), cache_dir=os.path.join(workdir, "image_cache"))
+    results = {"images": args.images, "image_bytes": args.image_bytes, "server_delay_seconds": args.delay}
+    try:
+        ctx = FakeContext(fake_channel(server_url, messages=args.history, image_every=3))
+        results["history_cold_seconds"] = await timed_async(get_img.get_img_from_history, ctx, args.images)
+        results["history_warm_seconds"] = await timed_async(get_img.get_img_from_history, ctx, args.images)
+        results["history_calls"] = ctx.channel.history_calls
+
+        urls = [f"{server_url}/images/direct{i}.png" for i in range(args.images)]
+        results["urls_cold_seconds"] = await timed_async(get_img.get_img_from_urls, ctx, urls)
+        results["urls_cached_seconds"] = await timed_async(get_img.get_img_from_urls, ctx, urls)
+        results["http_requests"] = image_server.requests
+        results["files_sent"] = [files for _, files in ctx.sent]
+        results["cache"] = get_img.cache.stats()
+    finally:
+        await get_img.close()
+        await image_server.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--only", choices=["connector", "images"], help="run a single section")
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--late-game", type=float, default=1.0, help="0 for fresh players, 1 for players who have done nearly everything")
+    parser.add_argument("--recipes", type=int, default=1200)
+    parser.add_argument("--parse-workers", type=int, default=1)
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of advancement files touched per changed tick")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--image-bytes", type=int, default=512 * 1024)
+    parser.add_argument("--history", type=int, default=200, help="messages in the fake channel's history")
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated CDN latency per image")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {"benchmark": "suite", "python": sys.version.split()[0]}
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.only in (None, "connector"):
+            results["connector"] = bench_connector(args, workdir)
+        if args.only in (None, "images"):
+            results["images"] = asyncio.run(bench_images(args, workdir))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os, json, random, uuid
+from datetime import datetime, timedelta
+
+# Run from the repository root so the bot's modules are importable, E.G. python -m benchmarks.advancement_parse
+from minecraft_connector import first_time_announcements, always_announcements
+
+BIOMES = [f"minecraft:biome_{i}" for i in range(53)]
+MOBS = [f"minecraft:mob_{i}" for i in range(35)]
+FOODS = [f"minecraft:food_{i}" for i in range(40)]
+UNANNOUNCED_ADVANCEMENTS = [f"minecraft:{category}/unannounced_{i}" for category in ("story", "nether", "end", "adventure", "husbandry") for i in range(18)]
+
+def timestamp(rng: random.Random) -> str:
+    moment = datetime(2024, 1, 1) + timedelta(seconds=rng.randrange(365 * 24 * 60 * 60))
+    return moment.strftime("%Y-%m-%d %H:%M:%S -0500")
+
+def advancement_entry(rng: random.Random, criteria: list, done: bool) -> dict:
+    achieved = criteria if done else criteria[:rng.randrange(len(criteria))]
+    return {"criteria": {c: timestamp(rng) for c in achieved}, "done": done}
+
+'''
+Build the contents of one player's advancements file
+  late_game controls how many recipes and advancements the player has unlocked, from 0 (fresh join) to 1 (completionist)
+'''
+def player_advancements(rng: random.Random, late_game: float = 1.0, recipes: int = 1200) -> dict:
+    data = {}
+    for i in range(int(recipes * late_game)):
+        data[f"minecraft:recipes/misc/recipe_{i}"] = advancement_entry(rng, [f"has_item_{i}", "has_the_recipe"], True)
+    for adv in UNANNOUNCED_ADVANCEMENTS:
+        if rng.random() < late_game:
+            data[adv] = advancement_entry(rng, ["criterion"], True)
+    for adv in list(first_time_announcements) + list(always_announcements):
+        if rng.random() < late_game * 0.8:
+            if adv == "minecraft:adventure/adventuring_time":
+                criteria = BIOMES
+            elif adv == "minecraft:adventure/kill_all_mobs":
+                criteria = MOBS
+            elif adv == "minecraft:husbandry/balanced_diet":
+                criteria = FOODS
+            else:
+                criteria = ["criterion"]
+            data[adv] = advancement_entry(rng, criteria, rng.random() < 0.7)
+    data["DataVersion"] = 3953
+    return data
+
+'''
+Write a synthetic Minecraft server layout under minecraft_home
+  <minecraft_home>/whitelist.json and <minecraft_home>/<world_name>/advancements/<uuid>.json for each player
+  Returns the list of player UUIDs
+'''
+def generate_world(minecraft_home: str, world_name: str = "world", players: int = 100, late_game: float = 1.0, recipes: int = 1200, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    advancements_dir = os.path.join(minecraft_home, world_name, "advancements")
+    os.makedirs(advancements_dir, exist_ok=True)
+    whitelist = []
+    for i in range(players):
+        player_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+        whitelist.append({"uuid": player_uuid, "name": f"Player{i}"})
+        with open(os.path.join(advancements_dir, f"{player_uuid}.json"), 'w') as f:
+            json.dump(player_advancements(rng, late_game, recipes), f, indent=2)
+    with open(os.path.join(minecraft_home, "whitelist.json"), 'w') as f:
+        json.dump(whitelist, f, indent=2)
+    return [entry["uuid"] for entry in whitelist]
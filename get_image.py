@@ -1,10 +1,31 @@
-import requests, re, discord, io
+import re, discord, io, os, asyncio
 from logging import Logger
 from discord.ext import commands
+from image_downloader import ImageDownloader
+from image_cache import ImageCache, normalize_url, hash_file
+from image_index import RecentImageIndex
+from message_resolver import MessageResolver
+from metrics import registry
+from ttl_cache import TTLCache
+from image_processing import ImageProcessor
 
 class GetImage:
-    def __init__(self, logger: Logger):
+    def __init__(self, logger: Logger, max_concurrent_downloads: int = 4, download_timeout_seconds: float = 15, download_retries: int = 2,
+                 cache_dir: str = "image_cache", cache_max_bytes: int = 256 * 1024 * 1024, cache_ttl_seconds: float = 24 * 60 * 60,
+                 max_remembered_uploads: int = 512, upload_ttl_seconds: float = 6 * 60 * 60, max_concurrent_transcodes: int = 2):
         self.logger = logger
+        self.downloader = ImageDownloader(logger, max_concurrency=max_concurrent_downloads, timeout_seconds=download_timeout_seconds, retries=download_retries)
+        self.cache = ImageCache(logger, cache_dir=cache_dir, max_bytes=cache_max_bytes, ttl_seconds=cache_ttl_seconds)
+        self.in_flight = {} # normalized URL -> task downloading it, shared by concurrent requests
+        self.processor = ImageProcessor(logger, max_concurrency=max_concurrent_transcodes)
+        self.index = RecentImageIndex(logger, self.extract_image_urls_from_message)
+        self.resolver = MessageResolver(logger)
+        # Images the bot has uploaded itself, so repeat requests can link them instead of uploading the bytes again
+        # Attachment URLs are signed by Discord and expire, so entries are only trusted for upload_ttl_seconds
+        self.uploads = TTLCache(max_remembered_uploads, upload_ttl_seconds)        # (guild ID, content hash) -> attachment URL
+        self.upload_messages = TTLCache(max_remembered_uploads, upload_ttl_seconds) # message ID -> keys into uploads
+        registry.gauge("akagi_image_cache", "Image cache counters and size", self.cache.stats, labelname="stat")
+        registry.gauge("akagi_message_resolver_rest_calls", "REST calls made to resolve message links", lambda: self.resolver.rest_calls)
 
     # Use a link to a specific message to retrieve and reupload its embeds
     async def get_img_from_message_link(self, ctx: commands.Context, url: str):
@@ -30,30 +51,22 @@ class GetImage:
             await ctx.send("Shikikan, please provide a number of recent embed messages between 1 and 10.")
             return
 
-        found = []
-        try:
-            async for msg in ctx.channel.history(limit=1000, oldest_first=False):
-                if self.extract_image_urls_from_message(msg):
-                    found.append(msg)
-                    if len(found) >= lookback:
-                        break
-        except discord.Forbidden:
-            self.logger.error(f"Missing permission to read message history in channel ID: {ctx.channel.id}")
-            await ctx.send("I'm sorry Shikikan, but I don't have permission to read message history in this channel.")
-            return
-        except discord.HTTPException as e:
-            self.logger.error(f"Error reading message history in channel ID: {ctx.channel.id}, error: {e}")
-            await ctx.send("I'm sorry Shikikan, but I ran into an error while reading recent messages.")
-            return
+        recent = self.index.get_recent(ctx.channel.id, lookback)
+        if recent is None:
+            recent = await self.scan_history(ctx, lookback)
+            if recent is None:
+                return
+        else:
+            self.logger.info(f"Answered lookback {lookback} from the image index for channel ID: {ctx.channel.id}")
 
-        if not found:
+        if not recent:
             await ctx.send("I'm sorry Shikikan, but I couldn't find any recent messages with images in embeds or attachments.")
             return
         
         # Collect image URLs from found messages
         image_urls = []
-        for message in found:
-            image_urls.extend(self.extract_image_urls_from_message(message))
+        for _, urls in recent:
+            image_urls.extend(urls)
         if len(image_urls) > 10:
             image_urls = image_urls[:10]
 
@@ -63,6 +76,36 @@ class GetImage:
         
         await self.get_img_from_urls(ctx, image_urls)
 
+    # Scan channel history to warm the image index, returning (message ID, image URLs) pairs newest first
+    # Returns None if the history could not be read, after telling the user why
+    async def scan_history(self, ctx: commands.Context, lookback: int) -> list:
+        channel_id = ctx.channel.id
+        found = []
+        exhaustive = True
+        self.index.begin_warm(channel_id)
+        try:
+            async for msg in ctx.channel.history(limit=1000, oldest_first=False):
+                urls = self.extract_image_urls_from_message(msg)
+                if urls:
+                    found.append((msg.id, urls))
+                    if len(found) >= self.index.capacity:
+                        exhaustive = False
+                        break
+        except discord.Forbidden:
+            self.index.abort_warm(channel_id)
+            self.logger.error(f"Missing permission to read message history in channel ID: {channel_id}")
+            await ctx.send("I'm sorry Shikikan, but I don't have permission to read message history in this channel.")
+            return None
+        except discord.HTTPException as e:
+            self.index.abort_warm(channel_id)
+            self.logger.error(f"Error reading message history in channel ID: {channel_id}, error: {e}")
+            await ctx.send("I'm sorry Shikikan, but I ran into an error while reading recent messages.")
+            return None
+
+        self.index.finish_warm(channel_id, found, exhaustive)
+        recent = self.index.get_recent(channel_id, lookback)
+        return recent if recent is not None else found[:lookback]
+
     def extract_image_urls_from_message(self, msg: discord.Message) -> list:
         image_urls = []
 
@@ -81,86 +124,165 @@ class GetImage:
         return image_urls
 
     # Helper to download images and reupload them with a message
+    # Duplicates within the batch are dropped, and images the bot uploaded recently are linked instead of uploaded again
     async def get_img_from_urls(self, ctx: commands.Context, urls: list):
         self.logger.info(f"Fetching images from URLs: {urls}")
 
-        images = []
-        n = 0
+        # The same image is often both the embed image and its thumbnail
+        unique_urls = {}
         for url in urls:
-            content = await self.download_image(url)
-            if content:
-                images.append(discord.File(io.BytesIO(content), filename=f"image{n}.png"))
-                n += 1
+            unique_urls.setdefault(normalize_url(url), url)
+        urls = list(unique_urls.values())
+        max_bytes = ctx.guild.filesize_limit if ctx.guild is not None else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+        guild_id = ctx.guild.id if ctx.guild is not None else None
+        # Images over the upload limit are still fetched if they can be shrunk to fit
+        download_limit = max(max_bytes, self.processor.max_source_bytes) if self.processor.can_resize else max_bytes
+        # Gather every result, so the files opened by the other downloads are still closed if one of them raises
+        results = await asyncio.gather(*(self.download_image(url, download_limit) for url in urls), return_exceptions=True)
+        downloads = [] # (file, content hash or None if it has to be computed)
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"Error downloading image from {url}: {result!r}")
+            elif result[0] is not None:
+                downloads.append(result)
+        files = [fp for fp, _ in downloads]
+        images = []
+        try:
+            if not files:
+                await ctx.send("I'm sorry Shikikan, but I couldn't download any images.")
+                return
 
-        if not images:
-            await ctx.send("I'm sorry Shikikan, but I couldn't download any images.")
-            return
-        
-        plural_msg = f"{len(images)} images" if len(images) > 1 else "the image"
-        await ctx.send(f"Shikikan-sama, I have retrieved {plural_msg} for you.", files=images)
+            # Cached images are stored under their hash already, only downloads that could not be cached need hashing
+            computed = iter(await asyncio.gather(*(asyncio.to_thread(hash_file, fp) for fp, content_hash in downloads if content_hash is None)))
+            hashes = [content_hash if content_hash is not None else next(computed) for _, content_hash in downloads]
+            to_upload = [] # (file, content hash) of images that have to be uploaded
+            links = []     # attachment URLs of images that were uploaded recently
+            seen = set()
+            for fp, content_hash in zip(files, hashes):
+                if content_hash in seen:
+                    continue
+                seen.add(content_hash)
+                link = self.uploads.get((guild_id, content_hash))
+                if link is not None:
+                    links.append(link)
+                else:
+                    to_upload.append((fp, content_hash))
+            if len(seen) < len(files):
+                self.logger.info(f"Dropped {len(files) - len(seen)} duplicate images from the batch")
+
+            prepared = await asyncio.gather(*(self.processor.prepare(fp, max_bytes) for fp, _ in to_upload))
+            to_upload = [(fp, content_hash, extension) for (fp, extension), (_, content_hash) in zip(prepared, to_upload) if fp is not None]
+            files.extend(fp for fp, _, _ in to_upload) # Shrunk images are new files that need closing too
+            if not to_upload and not links:
+                await ctx.send("I'm sorry Shikikan, but those images are too big for me to upload.")
+                return
+
+            images = [discord.File(fp, filename=f"image{n}.{extension}") for n, (fp, _, extension) in enumerate(to_upload)]
+            self.logger.info(f"Image cache stats: {self.cache.stats()}, linking {len(links)} previously uploaded images")
+            count = len(images) + len(links)
+            plural_msg = f"{count} images" if count > 1 else "the image"
+            msg = f"Shikikan-sama, I have retrieved {plural_msg} for you."
+            if links:
+                msg += "\n" + "\n".join(links)
+            message = await ctx.send(msg, files=images) if images else await ctx.send(msg)
+            if message is not None and images:
+                self.remember_uploads(guild_id, message, [content_hash for _, content_hash, _ in to_upload])
+        finally:
+            # discord.File stubs out close() on the objects it wraps until it is closed itself
+            for image in images:
+                image.close()
+            for fp in files:
+                fp.close()
+
+    def remember_uploads(self, guild_id: int, message: discord.Message, hashes: list):
+        keys = []
+        for content_hash, attachment in zip(hashes, message.attachments):
+            self.uploads.put((guild_id, content_hash), attachment.url)
+            keys.append((guild_id, content_hash))
+        self.upload_messages.put(message.id, keys)
 
-    # Helper to get a message object from a Discord message URL
     async def get_message_from_url(self, ctx: commands.Context, url: str) -> discord.Message:
         pattern = r"https://(?:(?:ptb|canary)\.)?discord(?:app)?\.com/channels/(\d+)/(\d+)/(\d+)(?:[/?#].*)?$"
         match = re.match(pattern, url)
         if not match:
             self.logger.error(f"Invalid Discord message URL: {url}")
             return None
-        guild_id, channel_id, message_id = match.groups() 
-
-        guild = ctx.bot.get_guild(int(guild_id))
-        if not guild:
-            try:
-                guild = await ctx.bot.fetch_guild(int(guild_id))
-            except discord.NotFound:
-                self.logger.error(f"Guild not found for ID: {guild_id}")
-                return None
-            except discord.Forbidden:
-                self.logger.error(f"Missing permission to fetch guild for ID: {guild_id}")
-                return None
-            except discord.HTTPException as e:
-                self.logger.error(f"Error fetching guild from ID: {guild_id}, error: {e}")
-                return None
-            
-        channel_id_int = int(channel_id)
-        channel = guild.get_channel(channel_id_int)
-        if channel is None and hasattr(guild, "get_thread"):
-            channel = guild.get_thread(channel_id_int)
-        if channel is None:
-            try:
-                channel = await ctx.bot.fetch_channel(channel_id_int)
-            except discord.NotFound:
-                self.logger.error(f"Channel not found for ID: {channel_id}")
-                return None
-            except discord.Forbidden:
-                self.logger.error(f"Missing permission to fetch channel for ID: {channel_id}")
-                return None
-            except discord.HTTPException as e:
-                self.logger.error(f"Error fetching channel from ID: {channel_id}, error: {e}")
-                return None
-
-        if not channel:
-            self.logger.error(f"Channel not found for ID: {channel_id}")
-            return None
+        guild_id, channel_id, message_id = match.groups()
+        return await self.resolver.resolve(ctx.bot, int(guild_id), int(channel_id), int(message_id))
+
+    # Gateway event hooks keeping the image index and message cache current
+    def on_message_edit(self, message: discord.Message):
+        self.index.add_message(message)
+        self.resolver.on_message_edit(message)
+
+    def on_messages_deleted(self, channel_id: int, message_ids):
+        self.index.remove_messages(channel_id, message_ids)
+        self.resolver.on_messages_deleted(message_ids)
+        # Attachments of a deleted message stop being served, so they can no longer be linked
+        for message_id in message_ids:
+            for key in self.upload_messages.pop(message_id, []):
+                self.uploads.pop(key)
+
+    # Helper to download an image from a URL, served from the local cache when possible
+    # Returns (readable file object owned by the caller, its content hash), the hash is None when the file could not
+    # be cached, and (None, None) if the image is unavailable or over max_bytes
+    # Concurrent requests for the same URL share a single download
+    async def download_image(self, url: str, max_bytes: int = discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES) -> tuple:
+        content_hash, fp = await asyncio.to_thread(self.cache.open_entry, url)
+        if fp is not None:
+            self.logger.info(f"Serving image from cache: {url}")
+            return self.check_size(url, fp, max_bytes), content_hash
+
+        key = normalize_url(url)
+        task = self.in_flight.get(key)
+        is_owner = task is None
+        if is_owner:
+            task = asyncio.create_task(self.download_and_cache(url, max_bytes))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.cache.coalesced += 1
+
+        content_hash, fp = await asyncio.shield(task)
+        if is_owner:
+            # A spooled file was already held to max_bytes by the downloader, and may not have a file descriptor to check
+            return (self.check_size(url, fp, max_bytes), content_hash) if content_hash is not None else (fp, None)
+        if fp is None:
+            return None, None # The shared download failed, fetching it again here would only fail the same way
+        if content_hash is not None:
+            fp = await asyncio.to_thread(self.cache.open_blob, content_hash)
+            if fp is not None:
+                return self.check_size(url, fp, max_bytes), content_hash
+        # The shared download could not be cached, or was evicted already, so it cannot be handed to more than one caller
+        return await self.downloader.download(url, max_bytes), None
+
+    # Returns (content hash, open blob) once the download is in the cache, (None, spooled file) if it could not be cached,
+    # or (None, None) if the download failed
+    # Only the caller that started the download gets the returned file
+    async def download_and_cache(self, url: str, max_bytes: int) -> tuple:
+        spool = await self.downloader.download(url, max_bytes)
+        if spool is None:
+            return None, None
         try:
-            message = await channel.fetch_message(int(message_id))
-            return message
-        except discord.NotFound:
-            self.logger.error(f"Message not found for ID: {message_id}")
-            return None
-        except discord.Forbidden:
-            self.logger.error(f"Missing permission to fetch message for ID: {message_id}")
-            return None
-        except discord.HTTPException as e:
-            self.logger.error(f"Error fetching message from id: {message_id}, error: {e}")
+            content_hash, blob = await asyncio.to_thread(self.cache.put_file, url, spool)
+        except OSError as e:
+            self.logger.warning(f"Could not store image from {url} in cache: {e}")
+            content_hash = None
+        if content_hash is None:
+            spool.seek(0)
+            return None, spool
+        spool.close()
+        return content_hash, blob
+
+    def check_size(self, url: str, fp: io.IOBase, max_bytes: int) -> io.IOBase:
+        size = os.fstat(fp.fileno()).st_size
+        if size > max_bytes:
+            self.logger.error(f"Image at {url} is {size} bytes, over the {max_bytes} byte limit")
+            fp.close()
             return None
-    
-    # Helper to download an image from a URL
-    async def download_image(self, url: str) -> bytes:
-        self.logger.info(f"Downloading image from URL: {url}")
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.content
-        else:
-            self.logger.error(f"Failed to download image from {url}. Status code: {response.status_code}")
-            return None
\ No newline at end of file
+        return fp
+
+    # Release the shared HTTP session when the bot shuts down
+    async def close(self):
+        await self.downloader.close()
+        self.processor.close()
@@ -0,0 +1,195 @@
+import os, io, json, time, hashlib, tempfile, threading
+from collections import OrderedDict
+from logging import Logger
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Discord signs CDN attachment URLs with expiring query parameters, which must not split the cache
+DISCORD_CDN_HOSTS = {"cdn.discordapp.com", "media.discordapp.net"}
+DISCORD_CDN_SIGNATURE_PARAMS = {"ex", "is", "hm"}
+
+'''
+Normalize a URL so that equivalent links share one cache entry
+  Scheme and host are lowercased, the fragment is dropped and query parameters are sorted
+  Discord CDN signature parameters are stripped since they change on every fetch of the same attachment
+'''
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if host in DISCORD_CDN_HOSTS:
+        query = [(k, v) for k, v in query if k not in DISCORD_CDN_SIGNATURE_PARAMS]
+    return urlunsplit((parts.scheme.lower(), host, parts.path, urlencode(sorted(query)), ""))
+
+'''
+SHA-256 of a file's contents, the same hash blobs are stored under, leaving the file rewound
+'''
+def hash_file(fp: io.IOBase, chunk_size: int = 64 * 1024) -> str:
+    hasher = hashlib.sha256()
+    fp.seek(0)
+    while chunk := fp.read(chunk_size):
+        hasher.update(chunk)
+    fp.seek(0)
+    return hasher.hexdigest()
+
+class ImageCache:
+    '''
+    On-disk image cache
+      Entries are keyed by normalized URL and point at content-addressed blobs, so identical images share storage
+      The least recently used entries are evicted once the byte budget is exceeded, and entries expire after the TTL
+    '''
+    def __init__(self, logger: Logger, cache_dir: str = "image_cache", max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 24 * 60 * 60):
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.mutex = threading.Lock()
+        self.entries = OrderedDict() # normalized URL -> {"hash", "size", "stored_at"}, least recently used first
+        self.blob_refs = {}          # content hash -> number of entries referencing the blob
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.load_index()
+
+    def blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", content_hash[:2], content_hash)
+
+    '''
+    Restore the index from disk, dropping entries whose blobs have gone missing
+    '''
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                saved_entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not load image cache index from {self.index_path}, starting empty: {e}")
+            return
+        for url, entry in saved_entries:
+            if os.path.exists(self.blob_path(entry["hash"])):
+                self.add_entry(url, entry)
+        self.evict()
+        self.logger.info(f"Loaded image cache with {len(self.entries)} entries, {self.total_bytes} bytes")
+
+    def save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.index_path)
+
+    def add_entry(self, url: str, entry: dict):
+        self.entries[url] = entry
+        refs = self.blob_refs.get(entry["hash"], 0)
+        if refs == 0:
+            self.total_bytes += entry["size"]
+        self.blob_refs[entry["hash"]] = refs + 1
+
+    def remove_entry(self, url: str):
+        entry = self.entries.pop(url)
+        refs = self.blob_refs[entry["hash"]] - 1
+        if refs > 0:
+            self.blob_refs[entry["hash"]] = refs
+            return
+        del self.blob_refs[entry["hash"]]
+        self.total_bytes -= entry["size"]
+        try:
+            os.remove(self.blob_path(entry["hash"]))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> bool:
+        evicted = False
+        while self.total_bytes > self.max_bytes and self.entries:
+            self.remove_entry(next(iter(self.entries)))
+            self.evictions += 1
+            evicted = True
+        return evicted
+
+    '''
+    Open the cached blob for a URL for reading and return (content hash, file), or (None, None) on a miss
+    The caller owns the returned file, which stays readable even if the entry is evicted meanwhile
+    '''
+    def open_entry(self, url: str) -> tuple:
+        key = normalize_url(url)
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["stored_at"] > self.ttl_seconds:
+                self.remove_entry(key)
+                self.save_index()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, None
+            try:
+                fp = open(self.blob_path(entry["hash"]), 'rb')
+            except FileNotFoundError:
+                self.logger.warning(f"Image cache blob for {key} went missing, treating as a miss")
+                self.remove_entry(key)
+                self.save_index()
+                self.misses += 1
+                return None, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["hash"], fp
+
+    def open_blob(self, content_hash: str) -> io.BufferedReader:
+        try:
+            return open(self.blob_path(content_hash), 'rb')
+        except FileNotFoundError:
+            return None
+
+    '''
+    Copy a downloaded file into the cache, hashing it on the way, and return (content hash, blob opened for reading)
+    The blob is opened before anything can evict it, and the caller owns it like one from open_entry
+    The file is read from its current position, and (None, None) is returned if it is too big to cache
+    '''
+    def put_file(self, url: str, fp: io.IOBase, chunk_size: int = 64 * 1024) -> tuple:
+        key = normalize_url(url)
+        blobs_dir = os.path.join(self.cache_dir, "blobs")
+        os.makedirs(blobs_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=blobs_dir, suffix=".tmp", delete=False) as tmp:
+            try:
+                while chunk := fp.read(chunk_size):
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        if size > self.max_bytes:
+            os.remove(tmp.name)
+            return None, None
+
+        content_hash = hasher.hexdigest()
+        with self.mutex:
+            if key in self.entries:
+                self.remove_entry(key)
+            path = self.blob_path(content_hash)
+            if content_hash in self.blob_refs:
+                os.remove(tmp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp.name, path)
+            self.add_entry(key, {"hash": content_hash, "size": size, "stored_at": time.time()})
+            blob = open(path, 'rb')
+            self.evict()
+            self.save_index()
+        return content_hash, blob
+
+    def stats(self) -> dict:
+        with self.mutex:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes
+            }
@@ -0,0 +1,86 @@
+import asyncio, aiohttp, tempfile, time
+from logging import Logger
+from metrics import registry
+
+download_seconds = registry.histogram("akagi_image_download_seconds", "Time to download an image, including retries")
+download_bytes = registry.counter("akagi_image_download_bytes_total", "Bytes of image data downloaded")
+download_failures = registry.counter("akagi_image_download_failures_total", "Image downloads that were given up on")
+
+# Status codes worth retrying, everything else is treated as a permanent failure
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class ImageDownloader:
+    def __init__(self, logger: Logger, max_concurrency: int = 4, timeout_seconds: float = 15, retries: int = 2, retry_backoff_seconds: float = 0.5,
+                 spool_threshold_bytes: int = 1024 * 1024, chunk_size: int = 64 * 1024):
+        self.logger = logger
+        self.spool_threshold_bytes = spool_threshold_bytes
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    # The session is created lazily because it has to be bound to the bot's running event loop
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_seconds))
+        return self.session
+
+    # Stream a single URL into a temporary file, retrying transient failures with exponential backoff
+    # The body is kept in memory up to spool_threshold_bytes and spilled to disk past that
+    # Downloads larger than max_bytes are abandoned as soon as that is known, without retrying
+    async def download(self, url: str, max_bytes: int = None) -> tempfile.SpooledTemporaryFile:
+        self.logger.info(f"Downloading image from URL: {url}")
+        start = time.perf_counter()
+        spool = await self.fetch(url, max_bytes)
+        download_seconds.observe(time.perf_counter() - start)
+        if spool is None:
+            download_failures.inc()
+        return spool
+
+    async def fetch(self, url: str, max_bytes: int) -> tempfile.SpooledTemporaryFile:
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_backoff_seconds * 2 ** (attempt - 1))
+            try:
+                async with self.semaphore:
+                    async with self.get_session().get(url) as response:
+                        if response.status == 200:
+                            return await self.stream_body(url, response, max_bytes)
+                        if response.status not in RETRYABLE_STATUS_CODES:
+                            self.logger.error(f"Failed to download image from {url}. Status code: {response.status}")
+                            return None
+                        self.logger.warning(f"Download attempt {attempt + 1} for {url} failed with status code {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"Download attempt {attempt + 1} for {url} failed: {e!r}")
+        self.logger.error(f"Giving up on downloading image from {url} after {self.retries + 1} attempts")
+        return None
+
+    async def stream_body(self, url: str, response: aiohttp.ClientResponse, max_bytes: int) -> tempfile.SpooledTemporaryFile:
+        if max_bytes is not None and response.content_length is not None and response.content_length > max_bytes:
+            self.logger.error(f"Image at {url} is {response.content_length} bytes, over the {max_bytes} byte limit")
+            return None
+
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold_bytes)
+        try:
+            size = 0
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    self.logger.error(f"Image at {url} exceeded the {max_bytes} byte limit while downloading")
+                    spool.close()
+                    return None
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        download_bytes.inc(size)
+        spool.seek(0)
+        return spool
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,213 @@
+import os, json, asyncio, zipfile, shutil, discord
+from collections import deque
+from datetime import datetime
+from logging import Logger
+from discord.ext import commands
+from image_downloader import ImageDownloader
+from image_processing import sniff_format
+
+# Bytes a zip needs per entry besides the data: local file header, central directory record, and some slack
+ZIP_ENTRY_OVERHEAD = 30 + 46 + 64
+ZIP_END_OVERHEAD = 22 + 1024
+
+class ZipPart:
+    '''
+    A zip file being written to disk one entry at a time, so only the entry being copied is ever in memory
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.zip = zipfile.ZipFile(self.file, 'w', compression=zipfile.ZIP_STORED)
+        self.entries = 0
+        self.overhead = ZIP_END_OVERHEAD
+
+    def projected_size(self, entry_name: str, size: int) -> int:
+        return self.file.tell() + self.overhead + len(entry_name) * 2 + ZIP_ENTRY_OVERHEAD + size
+
+    def add(self, entry_name: str, fp, date_time: tuple):
+        info = zipfile.ZipInfo(entry_name, date_time=date_time)
+        with self.zip.open(info, 'w') as entry:
+            shutil.copyfileobj(fp, entry, 64 * 1024)
+        self.entries += 1
+        self.overhead += len(entry_name) + 46
+
+    def close(self):
+        self.zip.close()
+        self.file.close()
+
+class ImageExporter:
+    '''
+    Exports every image in a channel's history to zip files, uploaded to the invoking channel part by part
+      History is walked oldest first and images are found the way GetImage finds them, but downloaded by the
+      exporter's own downloader, with at most max_concurrency in flight, so an export neither churns the image cache
+      nor queues a!get behind it
+      Images are written in order into a zip on disk, which is sent and deleted once the next image would push it over
+      the upload limit, so memory use does not grow with the size of the channel
+      Progress is saved after every part, so an interrupted export picks up after the last part it sent
+    '''
+    def __init__(self, logger: Logger, get_img, export_dir: str = "exports", max_concurrency: int = 4):
+        self.logger = logger
+        self.get_img = get_img
+        self.downloader = ImageDownloader(logger, max_concurrency=max_concurrency)
+        self.export_dir = export_dir
+        self.max_concurrency = max_concurrency
+        self.running = set() # channel IDs with an export in progress
+
+    async def close(self):
+        await self.downloader.close()
+
+    def state_path(self, channel_id: int) -> str:
+        return os.path.join(self.export_dir, f"{channel_id}.json")
+
+    '''
+    Load the saved progress of an export of the same channel and date range, or start a new one
+    '''
+    def load_state(self, channel_id: int, after: datetime, before: datetime) -> dict:
+        state = {
+            "channel_id": channel_id,
+            "after": after.isoformat() if after else None,
+            "before": before.isoformat() if before else None,
+            "checkpoint": None, # ID of the last message whose images have all been sent
+            "parts": 0,
+            "images": 0,
+            "skipped": 0
+        }
+        path = self.state_path(channel_id)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read export progress from {path}, starting over: {e}")
+                return state
+            if saved["after"] == state["after"] and saved["before"] == state["before"]:
+                return saved
+        return state
+
+    def save_state(self, state: dict):
+        path = self.state_path(state["channel_id"])
+        with open(path + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    async def export(self, ctx: commands.Context, channel, after: datetime = None, before: datetime = None):
+        # The archive is posted where the command was typed, so it must not reveal a channel the invoker cannot read
+        invoker_permissions = channel.permissions_for(ctx.author)
+        if not (invoker_permissions.view_channel and invoker_permissions.read_message_history):
+            self.logger.warning(f"Refusing export of channel ID {channel.id} to {ctx.author}, who cannot read its history")
+            await ctx.send("Sorry Shikikan, but you can't read that channel's history, so I can't export it for you.")
+            return
+        if channel.id in self.running:
+            await ctx.send("Shikikan, I'm already exporting that channel. Please be patient~")
+            return
+        self.running.add(channel.id)
+        try:
+            await self.run_export(ctx, channel, after, before)
+        finally:
+            self.running.discard(channel.id)
+
+    async def run_export(self, ctx: commands.Context, channel, after: datetime, before: datetime):
+        os.makedirs(self.export_dir, exist_ok=True)
+        state = self.load_state(channel.id, after, before)
+        run = ExportRun(self, ctx, channel, state)
+
+        history_after = after
+        if state["checkpoint"] is not None:
+            history_after = discord.Object(id=state["checkpoint"])
+            await ctx.send(f"Shikikan, I'm resuming the export of {channel.mention} after part {state['parts']}.")
+        else:
+            await ctx.send(f"Shikikan, I'm exporting every image in {channel.mention}. I'll send the archive in parts as I go!")
+        self.save_state(state)
+
+        try:
+            async for msg in channel.history(limit=None, after=history_after, before=before, oldest_first=True):
+                urls = self.get_img.extract_image_urls_from_message(msg)
+                for n, url in enumerate(urls):
+                    task = asyncio.create_task(self.downloader.download(url, run.max_image_bytes))
+                    run.pending.append((msg.id, f"{msg.id}_{n}", msg.created_at.timetuple()[:6], n == len(urls) - 1, task))
+                    # Write out the oldest downloads while the window is full, keeping at most max_concurrency in flight
+                    while len(run.pending) >= self.max_concurrency:
+                        await run.write_next()
+            while run.pending:
+                await run.write_next()
+            if run.part is not None:
+                await run.send_part()
+        finally:
+            run.abort()
+
+        os.remove(self.state_path(channel.id))
+        await ctx.send(f"All done, Shikikan! I exported {state['images']} images from {channel.mention} in {state['parts']} part(s)"
+                       + (f", skipping {state['skipped']} that were unavailable or too big." if state["skipped"] else "."))
+
+class ExportRun:
+    '''
+    State of one export while it runs
+      Images and skips are only added to the saved totals once the part holding them has been sent,
+      since anything after the last sent part is fetched again on resume
+    '''
+    def __init__(self, exporter: ImageExporter, ctx: commands.Context, channel, state: dict):
+        self.exporter = exporter
+        self.ctx = ctx
+        self.channel = channel
+        self.state = state
+        self.upload_limit = ctx.guild.filesize_limit if ctx.guild is not None else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+        self.max_image_bytes = self.upload_limit - ZIP_END_OVERHEAD - ZIP_ENTRY_OVERHEAD - 256
+        self.pending = deque()   # (message ID, entry name, date_time, is the message's last image, download task), in history order
+        self.part = None         # ZipPart being written, None until the first image after a send
+        self.last_in_part = None # ID of the last message whose images are all in sent parts or the current one
+        self.unsent_skips = 0
+
+    '''
+    Wait for the oldest pending download and add it to the current part, sending the part first if it would not fit
+    '''
+    async def write_next(self):
+        message_id, name, date_time, is_last, task = self.pending.popleft()
+        fp = await task
+        if fp is None:
+            self.unsent_skips += 1
+        else:
+            try:
+                extension = sniff_format(fp.read(16))[1]
+                fp.seek(0, os.SEEK_END)
+                size = fp.tell()
+                fp.seek(0)
+                entry_name = f"{name}.{extension}"
+                if self.part is not None and self.part.projected_size(entry_name, size) > self.upload_limit:
+                    await self.send_part()
+                if self.part is None:
+                    self.part = ZipPart(os.path.join(self.exporter.export_dir, f"{self.channel.id}_part{self.state['parts'] + 1}.zip"))
+                self.part.add(entry_name, fp, date_time)
+            finally:
+                fp.close()
+        if is_last:
+            self.last_in_part = message_id
+
+    async def send_part(self):
+        part, self.part = self.part, None
+        part.close()
+        number = self.state["parts"] + 1
+        try:
+            await self.ctx.send(f"Part {number} of the {self.channel.name} export, Shikikan.",
+                                file=discord.File(part.path, filename=f"{self.channel.name}_part{number}.zip"))
+        finally:
+            os.remove(part.path)
+        self.state["parts"] = number
+        self.state["images"] += part.entries
+        self.state["skipped"] += self.unsent_skips
+        self.unsent_skips = 0
+        if self.last_in_part is not None:
+            self.state["checkpoint"] = self.last_in_part
+        self.exporter.save_state(self.state)
+        self.exporter.logger.info(f"Sent export part {number} for channel ID {self.channel.id}, {self.state['images']} images so far")
+
+    '''
+    Stop outstanding downloads and discard the unsent part, its images are fetched again when the export is resumed
+    '''
+    def abort(self):
+        for *_, task in self.pending:
+            task.cancel()
+        self.pending.clear()
+        if self.part is not None:
+            self.part.close()
+            os.remove(self.part.path)
+            self.part = None
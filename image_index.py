@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict
+from logging import Logger
+
+class ChannelImageIndex:
+    def __init__(self):
+        self.entries = OrderedDict() # message ID -> (image URLs, time indexed), oldest message first
+        self.warm = False            # False while the history scan seeding this channel is still running
+        self.deleted = set()         # Message IDs deleted while the history scan was running
+        self.exhaustive = False      # True if the history scan found every image-bearing message within its limit
+
+class RecentImageIndex:
+    '''
+    In-memory index of the most recent image-bearing messages per channel
+      A channel is warmed from its history the first time it is queried, and kept current by gateway events afterwards
+      Events for channels that have never been queried are ignored
+      Each channel holds at most `capacity` messages, and at most `max_channels` channels are indexed at once
+      Attachment URLs are signed by Discord and expire, so entries older than `max_entry_age_seconds` make the channel cold again
+    '''
+    def __init__(self, logger: Logger, extract_image_urls, capacity: int = 20, max_channels: int = 500, max_entry_age_seconds: float = 6 * 60 * 60):
+        self.logger = logger
+        self.extract_image_urls = extract_image_urls
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self.max_entry_age_seconds = max_entry_age_seconds
+        self.channels = OrderedDict() # channel ID -> ChannelImageIndex, least recently queried first
+
+    '''
+    Return up to `count` (message ID, image URLs) pairs, newest first, or None if the channel has to be scanned instead
+    '''
+    def get_recent(self, channel_id: int, count: int) -> list:
+        channel = self.channels.get(channel_id)
+        if channel is None or not channel.warm:
+            return None
+        if len(channel.entries) < count and not channel.exhaustive:
+            self.logger.debug(f"Image index for channel ID {channel_id} has too few entries, falling back to history")
+            return None
+
+        recent = list(reversed(channel.entries.items()))[:count]
+        oldest_needed = min((indexed_at for _, (_, indexed_at) in recent), default=time.time())
+        if time.time() - oldest_needed > self.max_entry_age_seconds:
+            self.logger.debug(f"Image index for channel ID {channel_id} has expired entries, falling back to history")
+            del self.channels[channel_id]
+            return None
+
+        self.channels.move_to_end(channel_id)
+        return [(message_id, urls) for message_id, (urls, _) in recent]
+
+    '''
+    Start recording events for a channel whose history is about to be scanned, so nothing posted mid-scan is missed
+    '''
+    def begin_warm(self, channel_id: int):
+        self.channels.pop(channel_id, None)
+        self.channels[channel_id] = ChannelImageIndex()
+        while len(self.channels) > self.max_channels:
+            self.channels.popitem(last=False)
+
+    '''
+    Seed a channel's index from a history scan, merging in any events recorded during the scan
+      entries: (message ID, image URLs) pairs in any order
+      exhaustive: whether the scan covered every message it was allowed to look at
+    '''
+    def finish_warm(self, channel_id: int, entries: list, exhaustive: bool):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return # Evicted while scanning
+        now = time.time()
+        merged = {message_id: (urls, now) for message_id, urls in entries}
+        merged.update(channel.entries)
+        for message_id in channel.deleted:
+            merged.pop(message_id, None)
+        channel.deleted.clear()
+        channel.entries = OrderedDict((message_id, merged[message_id]) for message_id in sorted(merged)[-self.capacity:])
+        channel.exhaustive = exhaustive and len(merged) <= self.capacity
+        channel.warm = True
+        self.logger.info(f"Warmed image index for channel ID {channel_id} with {len(channel.entries)} messages")
+
+    def abort_warm(self, channel_id: int):
+        channel = self.channels.get(channel_id)
+        if channel is not None and not channel.warm:
+            del self.channels[channel_id]
+
+    '''
+    Record a new or edited message, only for channels that are warm or being warmed
+    '''
+    def add_message(self, message):
+        channel = self.channels.get(message.channel.id)
+        if channel is None:
+            return
+        urls = self.extract_image_urls(message)
+        if not urls:
+            self.remove_messages(message.channel.id, [message.id])
+            return
+        if message.id in channel.entries:
+            channel.entries[message.id] = (urls, time.time())
+            return
+        if len(channel.entries) >= self.capacity and message.id < next(iter(channel.entries)):
+            return # Older than everything the index holds, e.g. an edit to an ancient message
+        out_of_order = len(channel.entries) > 0 and message.id < next(reversed(channel.entries))
+        channel.entries[message.id] = (urls, time.time())
+        if out_of_order:
+            channel.entries = OrderedDict(sorted(channel.entries.items()))
+        while len(channel.entries) > self.capacity:
+            channel.entries.popitem(last=False)
+            channel.exhaustive = False
+
+    def remove_messages(self, channel_id: int, message_ids):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return
+        for message_id in message_ids:
+            channel.entries.pop(message_id, None)
+            if not channel.warm:
+                channel.deleted.add(message_id)
@@ -0,0 +1,141 @@
+import io, os, shutil, asyncio, tempfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+
+# Pillow is optional, without it images are only renamed to match their format, never resized
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+'''
+Identify an image format from the first bytes of the file, returning (format, file extension)
+Unrecognized data is reported as ("unknown", "png"), which is what every image used to be named
+'''
+def sniff_format(header: bytes) -> tuple:
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png", "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg", "jpg"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "gif", "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp", "webp"
+    if header.startswith(b"BM"):
+        return "bmp", "bmp"
+    return "unknown", "png"
+
+'''
+Re-encode the image at source_path so it fits in max_bytes, downscaling it until it does, write it to dest_path
+and return its file extension
+Images with transparency become WebP to keep it, everything else becomes JPEG
+Returns None for animated images, which cannot be shrunk without losing their animation
+Runs in a worker process, so images are passed by path rather than pickled to and from it
+'''
+def shrink_image(source_path: str, dest_path: str, max_bytes: int, quality: int = 85, max_attempts: int = 8) -> str:
+    with Image.open(source_path) as source:
+        if getattr(source, "is_animated", False):
+            return None
+        has_alpha = source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info
+        image = source.convert("RGBA" if has_alpha else "RGB")
+    image_format, extension = ("WEBP", "webp") if has_alpha else ("JPEG", "jpg")
+
+    width, height = image.size
+    scale = 1.0
+    for _ in range(max_attempts):
+        frame = image if scale >= 1 else image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+        out = io.BytesIO()
+        frame.save(out, image_format, quality=quality)
+        if out.tell() <= max_bytes:
+            with open(dest_path, 'wb') as dest:
+                dest.write(out.getbuffer())
+            return extension
+        # Encoded size scales roughly with pixel count, so shrink each side by the square root of the overshoot
+        scale *= min(0.9, (max_bytes / out.tell()) ** 0.5 * 0.95)
+    return None
+
+class ImageProcessor:
+    '''
+    Prepares downloaded images for upload: names them after their real format, and shrinks ones over the upload limit
+      Shrinking is CPU-heavy, so it runs in a process pool, with at most max_concurrency images in flight
+      Images go to and from the workers as files on disk, so the bot never holds a whole source image in memory
+      Images over max_source_bytes are not worth downloading to shrink, and nothing is shrunk without Pillow
+    '''
+    def __init__(self, logger: Logger, max_concurrency: int = 2, max_workers: int = None, max_source_bytes: int = 64 * 1024 * 1024):
+        self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.max_workers = max_workers or min(max_concurrency, os.cpu_count() or 1)
+        self.max_source_bytes = max_source_bytes
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = None
+
+    @property
+    def can_resize(self) -> bool:
+        return Image is not None
+
+    # The pool is created on first use, most requests never need it
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    '''
+    Return (file, extension) ready to upload, or (None, None) if the image is over max_bytes and cannot be shrunk
+    The returned file may be a new one, in which case fp has been closed
+    '''
+    async def prepare(self, fp: io.IOBase, max_bytes: int) -> tuple:
+        header = fp.read(16)
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        fp.seek(0)
+        image_format, extension = sniff_format(header)
+        if size <= max_bytes:
+            return fp, extension
+
+        if not self.can_resize:
+            self.logger.error(f"Image is {size} bytes, over the {max_bytes} byte limit, and Pillow is not installed to shrink it")
+            return None, None
+        async with self.semaphore:
+            source_path, source_copy = await asyncio.to_thread(self.source_path, fp)
+            fd, dest_path = tempfile.mkstemp(suffix=".img")
+            os.close(fd)
+            try:
+                extension = await asyncio.get_running_loop().run_in_executor(self.get_executor(), shrink_image, source_path, dest_path, max_bytes)
+                # A plain file object, discord.File takes anything else for a path, and nothing is left behind once it is closed
+                dest = open(dest_path, 'rb') if extension is not None else None
+            except Exception as e:
+                self.logger.error(f"Could not shrink {image_format} image of {size} bytes: {e!r}")
+                return None, None
+            finally:
+                os.remove(dest_path)
+                if source_copy is not None:
+                    source_copy.close()
+        if dest is None:
+            self.logger.error(f"Could not shrink {image_format} image of {size} bytes under the {max_bytes} byte limit")
+            return None, None
+        self.logger.info(f"Shrunk {image_format} image from {size} to {os.fstat(dest.fileno()).st_size} bytes")
+        fp.close()
+        return dest, extension
+
+    '''
+    Return (path a worker can open the image at, temporary copy to close when done or None)
+    Cache blobs and named temporary files are used in place, anything else is copied to disk first
+    '''
+    def source_path(self, fp: io.IOBase) -> tuple:
+        path = getattr(fp, "name", None)
+        if isinstance(path, str) and os.path.isfile(path):
+            return path, None
+        copy = tempfile.NamedTemporaryFile(suffix=".img")
+        try:
+            shutil.copyfileobj(fp, copy, 64 * 1024)
+            copy.flush()
+        except BaseException:
+            copy.close()
+            raise
+        fp.seek(0)
+        return copy.name, copy
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,62 @@
+import os, ctypes, ctypes.util, select, struct
+
+# Constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatcher:
+    '''
+    Minimal Linux inotify binding for watching a single directory, using ctypes so no extra dependency is needed
+    Raises OSError if inotify is unavailable on this platform or the directory cannot be watched
+    '''
+    def __init__(self, path: str, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO):
+        self.path = path
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None or not hasattr(select, "poll"):
+            raise OSError("inotify is not available on this platform")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err), path)
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    '''
+    Wait up to timeout_seconds for events, returning a list of (file name, event mask) pairs
+    An empty list means the timeout expired without any events
+    '''
+    def read_events(self, timeout_seconds: float) -> list:
+        if not self.poller.poll(max(0, int(timeout_seconds * 1000))):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+            offset += name_len
+            events.append((name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,152 @@
+import os, json, threading
+from collections import deque
+from logging import Logger
+
+class MessageLog:
+    '''
+    Durable, append-only log of announcement messages, each tagged with an increasing sequence number
+      Records are stored as JSON lines: {"seq": n, "text": ...} for messages and {"ack": n, "consumer": name} for acknowledgements
+      Each consumer has its own acknowledgement cursor, and messages stay in the log until every consumer
+      acknowledges them, so a failed delivery can be fetched again, and a restarted server picks up where it left off
+      At most max_entries messages are kept, a consumer that falls further behind than that misses the oldest ones
+      The file is rewritten without acknowledged messages once compact_threshold obsolete records pile up
+    '''
+    def __init__(self, logger: Logger, path: str, consumers: list = ("default",), compact_threshold: int = 1000, max_entries: int = 1000):
+        self.logger = logger
+        self.path = path
+        self.consumers = list(consumers)
+        self.compact_threshold = compact_threshold
+        self.max_entries = max_entries
+        self.mutex = threading.Lock()
+        self.available = threading.Condition(self.mutex) # notified whenever a message is appended, to wake long polls
+        self.entries = deque()  # (seq, text) of messages not yet acknowledged by every consumer, oldest first
+        self.next_seq = 1
+        self.acked = {}         # consumer name -> sequence number of the last message it acknowledged
+        self.missed = {consumer: 0 for consumer in self.consumers} # consumer name -> messages dropped before it acknowledged them
+        self.obsolete_records = 0
+        self.load()
+        self.compact()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Only the last line can be torn by a crash mid-write, anything it held was never acknowledged
+                        self.logger.warning(f"Skipping unreadable record in message log {self.path}")
+                        continue
+                    if "ack" in record:
+                        # Logs written before consumers existed have a single unnamed cursor
+                        consumer = record.get("consumer", "default")
+                        if consumer in self.missed:
+                            self.acked[consumer] = max(self.acked.get(consumer, 0), record["ack"])
+                    else:
+                        self.entries.append((record["seq"], record["text"]))
+                        self.next_seq = max(self.next_seq, record["seq"] + 1)
+            self.next_seq = max([self.next_seq] + [seq + 1 for seq in self.acked.values()])
+
+        # Consumers added since the log was last written start from the end instead of replaying old messages
+        start_seq = self.next_seq - 1 if self.acked else 0
+        for consumer in self.consumers:
+            self.acked.setdefault(consumer, start_seq)
+        self.trim()
+        self.logger.info(f"Loaded message log from {self.path}, {len(self.entries)} buffered messages for {len(self.consumers)} consumers")
+
+    '''
+    Drop messages every consumer has acknowledged, and the oldest ones beyond max_entries
+    '''
+    def trim(self):
+        floor = min(self.acked.values())
+        while self.entries and self.entries[0][0] <= floor:
+            self.entries.popleft()
+            self.obsolete_records += 1
+        while len(self.entries) > self.max_entries:
+            seq, _ = self.entries.popleft()
+            self.obsolete_records += 1
+            for consumer, acked_seq in self.acked.items():
+                if acked_seq < seq:
+                    if self.missed[consumer] == 0:
+                        self.logger.warning(f"Message log consumer {consumer} is more than {self.max_entries} messages behind, dropping its oldest messages")
+                    self.missed[consumer] += 1
+
+    def write_record(self, record: dict):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    '''
+    Rewrite the log with only the acknowledgement cursors and buffered messages
+    '''
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for consumer, acked_seq in self.acked.items():
+                f.write(json.dumps({"ack": acked_seq, "consumer": consumer}) + "\n")
+            for seq, text in self.entries:
+                f.write(json.dumps({"seq": seq, "text": text}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if getattr(self, "file", None) is not None:
+            self.file.close()
+        self.file = open(self.path, 'a')
+        self.obsolete_records = 0
+
+    def append(self, text: str) -> int:
+        with self.mutex:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.write_record({"seq": seq, "text": text})
+            self.entries.append((seq, text))
+            self.trim()
+            if self.obsolete_records >= self.compact_threshold:
+                self.compact()
+            self.available.notify_all()
+            return seq
+
+    '''
+    Return up to limit (seq, text) pairs with a sequence number greater than after
+    If there are none, waits up to wait_seconds for one to be appended
+    '''
+    def read_after(self, after: int, wait_seconds: float = 0, limit: int = 100) -> list:
+        with self.mutex:
+            if wait_seconds > 0:
+                self.available.wait_for(lambda: self.entries and self.entries[-1][0] > after, timeout=wait_seconds)
+            return [(seq, text) for seq, text in self.entries if seq > after][:limit]
+
+    '''
+    Mark every message up to and including seq as delivered to a consumer
+    '''
+    def ack(self, seq: int, consumer: str = "default"):
+        with self.mutex:
+            seq = min(seq, self.next_seq - 1)
+            if seq <= self.acked[consumer]:
+                return
+            self.acked[consumer] = seq
+            self.write_record({"ack": seq, "consumer": consumer})
+            self.obsolete_records += 1
+            self.trim()
+            if self.obsolete_records >= self.compact_threshold:
+                self.compact()
+
+    def get_acked_seq(self, consumer: str = "default") -> int:
+        with self.mutex:
+            return self.acked[consumer]
+
+    def get_last_seq(self) -> int:
+        with self.mutex:
+            return self.next_seq - 1
+
+    '''
+    Per-consumer delivery state, as {consumer name: {"acked_seq", "lag", "missed"}}
+      lag is the number of messages queued after the consumer's cursor
+    '''
+    def get_consumer_stats(self) -> dict:
+        with self.mutex:
+            last_seq = self.next_seq - 1
+            return {
+                consumer: {"acked_seq": acked_seq, "lag": last_seq - acked_seq, "missed": self.missed[consumer]}
+                for consumer, acked_seq in self.acked.items()
+            }
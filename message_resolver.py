@@ -0,0 +1,78 @@
+import discord
+from logging import Logger
+from ttl_cache import TTLCache
+
+class MessageResolver:
+    '''
+    Resolves (guild, channel, message) IDs from message links to message objects with as few REST calls as possible
+      Channels and threads come from the gateway cache first, then from a TTL cache of previously fetched ones
+      Fetched messages are cached as well, and kept current by gateway edit and delete events
+    '''
+    def __init__(self, logger: Logger, max_channels: int = 256, channel_ttl_seconds: float = 30 * 60, max_messages: int = 512, message_ttl_seconds: float = 10 * 60):
+        self.logger = logger
+        self.channels = TTLCache(max_channels, channel_ttl_seconds) # channel ID -> channel or thread
+        self.messages = TTLCache(max_messages, message_ttl_seconds) # message ID -> message
+        self.rest_calls = 0
+
+    async def resolve(self, bot, guild_id: int, channel_id: int, message_id: int) -> discord.Message:
+        message = self.messages.get(message_id)
+        if message is not None and message.channel.id == channel_id:
+            message_guild = getattr(message, "guild", None)
+            if message_guild is None or message_guild.id != guild_id:
+                self.logger.error(f"Message ID {message_id} does not belong to guild ID {guild_id}")
+                return None
+            return message
+
+        channel = await self.resolve_channel(bot, guild_id, channel_id)
+        if channel is None:
+            return None
+
+        try:
+            self.rest_calls += 1
+            message = await channel.fetch_message(message_id)
+        except discord.NotFound:
+            self.logger.error(f"Message not found for ID: {message_id}")
+            return None
+        except discord.Forbidden:
+            self.logger.error(f"Missing permission to fetch message for ID: {message_id}")
+            return None
+        except discord.HTTPException as e:
+            self.logger.error(f"Error fetching message from id: {message_id}, error: {e}")
+            return None
+        self.messages.put(message_id, message)
+        return message
+
+    async def resolve_channel(self, bot, guild_id: int, channel_id: int):
+        channel = bot.get_channel(channel_id) or self.channels.get(channel_id)
+        if channel is None:
+            try:
+                self.rest_calls += 1
+                channel = await bot.fetch_channel(channel_id)
+            except discord.NotFound:
+                self.logger.error(f"Channel not found for ID: {channel_id}")
+                return None
+            except discord.Forbidden:
+                self.logger.error(f"Missing permission to fetch channel for ID: {channel_id}")
+                return None
+            except discord.HTTPException as e:
+                self.logger.error(f"Error fetching channel from ID: {channel_id}, error: {e}")
+                return None
+            self.channels.put(channel_id, channel)
+
+        # Keep links consistent: the guild in the link has to be the channel's, whether or not anything is cached
+        # This is not an access check, a link to another server's channel can simply carry that server's ID
+        channel_guild = getattr(channel, "guild", None)
+        if channel_guild is None or channel_guild.id != guild_id:
+            self.logger.error(f"Channel ID {channel_id} does not belong to guild ID {guild_id}")
+            return None
+        return channel
+
+    def on_message_edit(self, message: discord.Message):
+        self.messages.update(message.id, message)
+
+    def on_messages_deleted(self, message_ids):
+        for message_id in message_ids:
+            self.messages.pop(message_id)
+
+    def on_channel_deleted(self, channel_id: int):
+        self.channels.pop(channel_id)
@@ -0,0 +1,171 @@
+import time, bisect, threading
+from aiohttp import web
+from logging import Logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.mutex = threading.Lock()
+        self.values = {} # label values -> count
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self.mutex:
+            values = list(self.values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in values]
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.mutex = threading.Lock()
+        self.values = {} # label values -> [per-bucket counts, with one more for +Inf, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.mutex:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    '''
+    Time a block of code, E.G. with histogram.time(command="get"): ...
+    '''
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def render(self) -> list:
+        with self.mutex:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class HistogramTimer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Gauge:
+    '''
+    Gauge whose value is read from a callback at scrape time, so state that is already tracked elsewhere
+    (E.G. cache stats or queue depths) costs nothing until it is scraped
+      callback: () -> number, or {label value: number} if the gauge has a label
+    '''
+    def __init__(self, name: str, help: str, callback, labelname: str = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelname = labelname
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if self.labelname is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            lines += [f"{self.name}{format_labels((self.labelname,), (label,))} {v}" for label, v in value.items() if v is not None]
+        return lines
+
+class MetricsRegistry:
+    '''
+    Collection of metrics rendered together in the Prometheus text exposition format
+    Registering a metric under a name that is already taken replaces the old one
+    '''
+    def __init__(self):
+        self.metrics = {} # name -> metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, callback, labelname: str = None) -> Gauge:
+        return self.register(Gauge(name, help, callback, labelname))
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry, every module registers its metrics here
+registry = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsServer:
+    '''
+    Serves the registry at /metrics from the bot's event loop, bound to localhost by default so it is
+    only reachable by a scraper running on the same machine
+    '''
+    def __init__(self, logger: Logger, host: str = "127.0.0.1", port: int = 9108):
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        async def handle_metrics(request):
+            return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            self.logger.error(f"Could not start metrics endpoint on {self.host}:{self.port}: {e}")
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -1,6 +1,10 @@
-import glob, os, json, flask, requests, threading, time, logging, asyncio, queue
+import glob, os, re, json, mmap, flask, aiohttp, random, threading, time, logging, asyncio, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from logging import Logger
-from requests.exceptions import ConnectTimeout
+from inotify_watcher import InotifyWatcher, IN_Q_OVERFLOW, IN_IGNORED
+from message_log import MessageLog
+from announcement_dispatcher import AnnouncementDispatcher, UndeliverableError, RETRY_LATER, UNDELIVERABLE
+from metrics import registry, CONTENT_TYPE
 
 ##############################################################
 ####   Static functions   ####################################
@@ -25,88 +29,252 @@ def load_props(role: str, logger: Logger):
             combined_props.update(role_props)
     return combined_props
 
+'''
+Cheap change detection for files that are polled, None if the file does not exist
+'''
+def stat_signature(path: str) -> tuple:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
 ##############################################################
 ####   Client-side connector (runs on akagi-bot)   ###########
 ##############################################################
 
+poll_seconds = registry.histogram("minecraft_connector_poll_seconds", "Duration of message polls to a server connector, including long poll waits", ["server"])
+poll_failures = registry.counter("minecraft_connector_poll_failures_total", "Failed polls to a server connector", ["server"])
+messages_received = registry.counter("minecraft_connector_messages_received_total", "Advancement messages fetched from a server connector", ["server"])
+
 class MinecraftConnector:
 
     def __init__(self, bot, logger: Logger):
         self.bot = bot
         self.logger = logger
         self.client_props = self.load_client_props()
-        self.http_client = self.create_client()
-        self.configure_cron_job(self.client_props["update_interval_seconds"])
+        self.upstreams = self.create_upstreams()
+        self.dispatcher = AnnouncementDispatcher(
+            logger,
+            self.send_to_channel,
+            prefix="Shikikan, ",
+            coalesce_seconds=self.client_props.get("announcement_coalesce_seconds", 0.5),
+            min_send_interval_seconds=self.client_props.get("announcement_min_interval_seconds", 1)
+        )
+        registry.gauge("minecraft_connector_dispatcher", "Announcement dispatcher queue depth, counters and latencies", self.dispatcher.get_stats, labelname="stat")
+        registry.gauge("minecraft_connector_connected", "Whether each server connector is reachable", lambda: {u.name: int(u.connected) for u in self.upstreams}, labelname="server")
 
     '''
     Load Minecraft server connection properties
       Put public attributes in a committed file matching the props_file_pattern
       Put private attributes in a .gitignored file matching the props_file_pattern
       Attributes are coalesced from all matching files, with later files overriding earlier ones
+      Several server connectors can be listed as "servers": [{"name": ..., "server_host": ..., ...}], each entry
+      inheriting any attribute it does not set from the top level, otherwise the top level describes a single server
     '''
     def load_client_props(self):
         props = load_props("client", self.logger)
-        for key in ["server_host", "server_port", "auth_token", "announcement_channel_id", "update_interval_seconds"]:
-            if key not in props:
-                msg = f"Missing required Minecraft connector client property: {key}"
-                self.logger.error(msg)
-                raise ValueError(msg)
+        defaults = {key: value for key, value in props.items() if key != "servers"}
+        props["servers"] = [{**defaults, **server_props} for server_props in props.get("servers", [{}])]
+        for server_props in props["servers"]:
+            for key in ["server_host", "server_port", "auth_token", "announcement_channel_id", "update_interval_seconds"]:
+                if key not in server_props:
+                    msg = f"Missing required Minecraft connector client property: {key}"
+                    self.logger.error(msg)
+                    raise ValueError(msg)
+            server_props.setdefault("name", f"{server_props['server_host']}:{server_props['server_port']}")
         return props
     
     '''
-    Create and configure the HTTP client for communicating with the Minecraft server connector
+    Create the connection state for every server connector to poll
     '''
-    def create_client(self):
-        return ConfiguredHTTPClient(
-            host=self.client_props["server_host"],
-            port=self.client_props["server_port"],
-            auth_token=self.client_props["auth_token"],
-            logger=self.logger
-        )
-    
+    def create_upstreams(self) -> list:
+        return [UpstreamServer(server_props, self.logger) for server_props in self.client_props["servers"]]
+
     '''
-    Configure a cron job to periodically fetch new advancement messages from the server connector
+    Start polling every server connector as a task on the bot's event loop, called once the loop is running
+    Each server has its own task, so a server that is down or slow does not hold up the others
     '''
-    def configure_cron_job(self, interval_seconds: int):
-        def run_periodically():
-            while True:
-                time.sleep(interval_seconds)
-                self.cron_job_worker()
-        thread = threading.Thread(target=run_periodically, daemon=True)
-        thread.start()
-        self.logger.info(f"Started background cron job with {interval_seconds}s interval")
+    async def start(self):
+        for upstream in self.upstreams:
+            if upstream.task is None:
+                upstream.task = asyncio.create_task(self.run_poll_loop(upstream), name=f"minecraft-connector-{upstream.name}")
+        self.logger.info(f"Started Minecraft connector poll tasks for {len(self.upstreams)} servers")
+
+    async def stop(self):
+        tasks = [upstream.task for upstream in self.upstreams if upstream.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.dispatcher.stop()
+        for upstream in self.upstreams:
+            upstream.task = None
+            await upstream.http_client.close()
 
     '''
-    Worker function for the cron job to fetch and send new advancement messages
-    to the designated Discord channel
+    Fetch new advancement messages from one server connector until cancelled
+      Requests are long polls held open by the server for up to long_poll_seconds, so messages arrive as soon
+      as they are queued, and the next poll is issued right away
+      While the server is unreachable, polls back off exponentially with jitter, and against a server
+      without long polling the interval tightens while messages are flowing and relaxes when idle
     '''
-    def cron_job_worker(self):
-        msgs = self.get_messages()
-        if len(msgs) > 0:
-            msg = "Shikikan, " + "\n".join([f'{m}!' for m in msgs])
-            self.logger.info(msg)
-            channel_id = self.client_props["announcement_channel_id"]
-            asyncio.run_coroutine_threadsafe(
-                self.send_to_channel(channel_id, msg),
-                self.bot.loop
-            )
+    async def run_poll_loop(self, upstream):
+        long_poll_seconds = upstream.props.get("long_poll_seconds", 25)
+        while True:
+            try:
+                if upstream.cursor is None and not upstream.legacy:
+                    upstream.cursor = await self.fetch_cursor(upstream)
+                    upstream.legacy = upstream.cursor is None and upstream.http_client.last_status == 404
+                    if upstream.legacy:
+                        self.logger.warning(f"Minecraft server connector {upstream.name} does not support acknowledgements, undelivered messages may be lost")
+                if upstream.cursor is None and not upstream.legacy:
+                    delay = upstream.on_failure()
+                else:
+                    params = {"wait": long_poll_seconds}
+                    if upstream.cursor is not None:
+                        params["after"] = upstream.cursor
+                    with poll_seconds.time(server=upstream.name):
+                        resp = await upstream.http_client.get("messages", params=params, timeout=long_poll_seconds + 5)
+                    if resp is None:
+                        delay = upstream.on_failure()
+                    elif not await self.announce(resp.get("messages", []), upstream.props["announcement_channel_id"]):
+                        # Not acknowledged, so the same messages will be fetched again on the next poll
+                        delay = upstream.on_failure()
+                    elif upstream.cursor is not None and resp.get("last_seq", upstream.cursor) < upstream.cursor:
+                        # The server's log was reset, so the cursor is meaningless and has to be fetched again
+                        self.logger.warning(f"Minecraft server connector {upstream.name} log is behind cursor {upstream.cursor}, resynchronizing")
+                        upstream.cursor = None
+                        delay = 0
+                    else:
+                        entries = resp.get("entries", [])
+                        messages_received.inc(len(resp.get("messages", [])), server=upstream.name)
+                        if upstream.cursor is not None and entries:
+                            upstream.cursor = entries[-1]["seq"]
+                            await upstream.http_client.post("ack", {"seq": upstream.cursor})
+                        delay = upstream.on_success(len(entries) > 0, long_poll_seconds > 0 and resp.get("long_poll", False))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The messages were not acknowledged and will be fetched again
+                self.logger.error(f"Unexpected error polling Minecraft server connector {upstream.name}: {e!r}")
+                delay = upstream.on_failure()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    '''
+    Ask a server where to resume, None if the server predates acknowledgements (404) or is unreachable
+    '''
+    async def fetch_cursor(self, upstream) -> int:
+        resp = await upstream.http_client.get("cursor")
+        if resp is None:
+            return None
+        self.logger.info(f"Resuming Minecraft connector {upstream.name} messages after seq {resp['acked_seq']}")
+        return resp["acked_seq"]
 
-    async def send_to_channel(self, channel_id: int, message: str):
+    '''
+    Send new advancement messages to a server's announcement channel through the dispatcher
+    Returns True once they can be acknowledged, False if sending kept failing and they have to be fetched again
+      Messages that cannot be delivered at all, to a missing channel or without permission, are acknowledged anyway,
+      fetching them again would only fail the same way and hold up every later message from the server
+    '''
+    async def announce(self, msgs: list, channel_id: int) -> bool:
+        if len(msgs) == 0:
+            return True
+        self.logger.info(f"Announcing {len(msgs)} advancement messages to channel ID {channel_id}")
+        outcome = await self.dispatcher.deliver(channel_id, [f'{m}!' for m in msgs])
+        if outcome == UNDELIVERABLE:
+            self.logger.error(f"Some advancement messages could not be announced to channel ID {channel_id}, check its announcement_channel_id and permissions")
+        return outcome != RETRY_LATER
+
+    async def send_to_channel(self, channel_id: int, message: str) -> bool:
+        # Channels are only known once the gateway cache has been filled
+        await self.bot.wait_until_ready()
         channel = self.bot.get_channel(channel_id)
-        if channel:
-            await channel.send(message)
-        else:
-            self.logger.error(f"Could not find channel with ID {channel_id}")
-        
+        if not channel:
+            raise UndeliverableError(f"Could not find channel with ID {channel_id}")
+        self.logger.info(message)
+        await channel.send(message)
+        return True
+
     '''
-    Unwraps message list from the server connector's JSON response
+    Connection state of every server connector, for status reporting
     '''
-    def get_messages(self):
-        resp = self.http_client.get("messages")
-        if resp is not None:
-            return resp.get("messages", [])
-        else:
-            return []
+    def get_upstream_stats(self) -> dict:
+        return {upstream.name: upstream.get_stats() for upstream in self.upstreams}
+
+class UpstreamServer:
+    '''
+    Connection state for one Minecraft server connector, kept separately so servers fail and recover independently
+    '''
+    def __init__(self, props: dict, logger: Logger):
+        self.name = props["name"]
+        self.props = props
+        self.logger = logger
+        self.http_client = ConfiguredHTTPClient(
+            host=props["server_host"],
+            port=props["server_port"],
+            auth_token=props["auth_token"],
+            logger=logger
+        )
+        self.backoff = AdaptiveBackoff(
+            base_seconds=props["update_interval_seconds"],
+            min_seconds=props.get("min_poll_interval_seconds", 2),
+            max_seconds=props.get("max_retry_interval_seconds", 300)
+        )
+        self.task = None
+        self.cursor = None      # sequence number of the last delivered message, None until the server says where to resume
+        self.legacy = False     # True if the server predates acknowledgements, in which case fetching consumes messages
+        self.connected = False
+        self.last_success = None
+
+    def on_failure(self) -> float:
+        poll_failures.inc(server=self.name)
+        if self.connected:
+            self.logger.warning(f"Lost connection to Minecraft server connector {self.name}")
+        self.connected = False
+        delay = self.backoff.on_failure()
+        self.logger.debug(f"Retrying Minecraft server connector {self.name} in {delay:.1f}s after {self.backoff.failures} failed polls")
+        return delay
+
+    def on_success(self, had_traffic: bool, long_poll: bool) -> float:
+        if not self.connected:
+            self.logger.info(f"Connected to Minecraft server connector {self.name}")
+        self.connected = True
+        self.last_success = time.time()
+        delay = self.backoff.on_success(had_traffic)
+        return 0 if long_poll else delay
+
+    def get_stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "cursor": self.cursor,
+            "failures": self.backoff.failures,
+            "seconds_since_success": None if self.last_success is None else round(time.time() - self.last_success, 1)
+        }
+
+class AdaptiveBackoff:
+    '''
+    Poll interval policy
+      Failures back off exponentially from base_seconds up to max_seconds, using full jitter so retries spread out
+      Successes reset the failure count, tighten the interval to min_seconds while there is traffic,
+      and double it back up towards base_seconds while idle
+    '''
+    def __init__(self, base_seconds: float, min_seconds: float, max_seconds: float):
+        self.base_seconds = base_seconds
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.interval = base_seconds
+        self.failures = 0
+
+    def on_failure(self) -> float:
+        self.failures += 1
+        cap = min(self.max_seconds, self.base_seconds * 2 ** (self.failures - 1))
+        return random.uniform(self.min_seconds, max(self.min_seconds, cap))
+
+    def on_success(self, had_traffic: bool) -> float:
+        self.failures = 0
+        self.interval = self.min_seconds if had_traffic else min(self.base_seconds, self.interval * 2)
+        return self.interval
 
 class ConfiguredHTTPClient:
     def __init__(self, host: str, port: int, auth_token: str, logger: Logger):
@@ -114,23 +282,63 @@ class ConfiguredHTTPClient:
         self.port = port
         self.auth_token = auth_token
         self.logger = logger
+        self.session = None
+        self.last_status = None # HTTP status of the most recent response, None if no response was received
+
+    # The session is created lazily because it has to be bound to the bot's running event loop
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                base_url=f"http://{self.host}:{self.port}",
+                headers={"Authorization": self.auth_token},
+                connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=60)
+            )
+        return self.session
 
     '''
-    Perform a GET request to the specified endpoint
+    Perform a GET request to the specified endpoint over a persistent keep-alive session
     self.auth_token is included in the Authorization header to act as a symmetric key
+    Returns the decoded JSON body, or None if the request failed for any reason
     '''
-    def get(self, endpoint: str):
+    async def get(self, endpoint: str, params: dict = None, timeout: float = 5):
+        self.last_status = None
         try:
-            response = requests.get(f"http://{self.host}:{self.port}/{endpoint}", headers={"Authorization": self.auth_token}, timeout=5)
-        except ConnectTimeout:
+            async with self.get_session().get(f"/{endpoint}", params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                self.last_status = response.status
+                if response.status == 200:
+                    return await response.json()
+                self.logger.error(f"HTTP GET request to {endpoint} failed with status code {response.status}")
+                return None
+        except asyncio.TimeoutError:
             self.logger.debug(f"Minecraft server connector not detected at {self.host}:{self.port} (timed out)")
             return None
-        if response.status_code == 200:
-            return response.json()
-        else:
-            self.logger.error(f"HTTP GET request to {endpoint} failed with status code {response.status_code}")
+        except aiohttp.ClientError as e:
+            self.logger.debug(f"Request to Minecraft server connector at {self.host}:{self.port} failed: {e!r}")
+            return None
+
+    '''
+    Perform a POST request with a JSON body, returning the decoded JSON response or None on failure
+    '''
+    async def post(self, endpoint: str, payload: dict, timeout: float = 5):
+        self.last_status = None
+        try:
+            async with self.get_session().post(f"/{endpoint}", json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                self.last_status = response.status
+                if response.status == 200:
+                    return await response.json()
+                self.logger.error(f"HTTP POST request to {endpoint} failed with status code {response.status}")
+                return None
+        except asyncio.TimeoutError:
+            self.logger.debug(f"Minecraft server connector not detected at {self.host}:{self.port} (timed out)")
+            return None
+        except aiohttp.ClientError as e:
+            self.logger.debug(f"Request to Minecraft server connector at {self.host}:{self.port} failed: {e!r}")
             return None
 
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
 ##############################################################
 ####   Server-side connector (runs on server.pro)   ##########
 ##############################################################
@@ -171,12 +379,111 @@ always_announcements = {
     "minecraft:husbandry/balanced_diet": "A Balanced Diet"
 }
 
+announcement_whitelist = frozenset(first_time_announcements) | frozenset(always_announcements)
+
+# Every announced advancement is interned to a bit, so a player's state is a single integer and diffing is bitwise
+announcement_ids = list(first_time_announcements) + list(always_announcements)
+announcement_bits = {adv: 1 << i for i, adv in enumerate(announcement_ids)}
+first_time_mask = sum(announcement_bits[adv] for adv in first_time_announcements)
+always_mask = sum(announcement_bits[adv] for adv in always_announcements)
+
+def advancements_to_mask(advancements) -> int:
+    mask = 0
+    for adv in advancements:
+        mask |= announcement_bits[adv]
+    return mask
+
+'''
+Yield the advancement IDs set in a mask, in announcement table order
+'''
+def mask_to_advancements(mask: int):
+    while mask:
+        lowest = mask & -mask
+        yield announcement_ids[lowest.bit_length() - 1]
+        mask ^= lowest
+json_decoder = json.JSONDecoder()
+
+# Matches object keys in the advancement categories that have announcements, E.G. "minecraft:story/...", but not recipes
+announced_category_pattern = re.compile(
+    rb'"((?:' + b"|".join(re.escape(c.encode()) for c in sorted({adv.rsplit("/", 1)[0] for adv in announcement_whitelist})) + rb')/[^"]+)"\s*:'
+)
+
+'''
+Read the announced advancements that are done from a player's advancements file
+  Advancement files are dominated by hundreds of recipe entries, so rather than parsing the whole document,
+  the memory-mapped file is scanned once for keys in the announced categories and only whitelisted values are decoded
+  Returns the done advancements as a mask of announcement bits
+  Raises ValueError if the file is not a complete JSON object, E.G. because the server is in the middle of writing it
+'''
+def parse_announced_advancements(path: str) -> int:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Advancements file {path} is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # A truncated file could silently drop entries, and they would be announced again once it is complete
+            if data[:64].lstrip()[:1] != b"{" or data[-64:].rstrip()[-1:] != b"}":
+                raise ValueError(f"Advancements file {path} is not a complete JSON object")
+            # Minecraft always writes DataVersion last, so its absence means the layout is unexpected and the slow path is safer
+            if b'"DataVersion"' not in data[-64:]:
+                full = json.loads(data[:])
+                return advancements_to_mask(adv for adv in announcement_whitelist if full.get(adv, {}).get("done", False))
+
+            done = 0
+            for match in announced_category_pattern.finditer(data):
+                adv = match.group(1).decode()
+                if adv not in announcement_whitelist:
+                    continue
+                # Only accept the key when it is an object key, not a string value that happens to match
+                if data[max(0, match.start() - 64):match.start()].rstrip()[-1:] not in (b"{", b","):
+                    continue
+                value = decode_value_at(data, match.end())
+                if isinstance(value, dict) and value.get("done", False):
+                    done |= announcement_bits[adv]
+            return done
+
+'''
+Worker-friendly wrapper around parse_announced_advancements that never raises, so it can be fanned out over a pool
+  Returns the mask, None if the file has disappeared, or the ValueError if it could not be parsed
+'''
+def parse_advancement_file(path: str):
+    try:
+        return parse_announced_advancements(path)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        return e
+
+'''
+Decode the JSON value starting at offset, reading progressively larger windows until it is complete
+'''
+def decode_value_at(data: mmap.mmap, offset: int):
+    window = 4096
+    while True:
+        chunk = data[offset:offset + window].decode("utf-8", errors="ignore").lstrip()
+        try:
+            return json_decoder.raw_decode(chunk)[0]
+        except json.JSONDecodeError:
+            if offset + window >= len(data):
+                raise
+            window *= 4
+
+tick_seconds = registry.histogram("minecraft_connector_tick_seconds", "Duration of advancement scans")
+files_scanned = registry.counter("minecraft_connector_files_scanned_total", "Advancement files checked for changes")
+files_parsed = registry.counter("minecraft_connector_files_parsed_total", "Changed advancement files parsed")
+messages_queued = registry.counter("minecraft_connector_messages_queued_total", "Advancement messages queued for announcement")
+
+# Bump whenever the snapshot layout or the meaning of its contents changes
+SNAPSHOT_VERSION = 1
+
 class MinecraftConnectorServer:
 
-    def __init__(self, logger: Logger):
+    def __init__(self, logger: Logger, server_props: dict = None):
         self.logger = logger
-        self.server_props = self.load_server_props()
+        self.server_props = server_props if server_props is not None else self.load_server_props()
         self.app = flask.Flask(__name__)
+        self.parse_executor = self.create_parse_executor()
+        self.consumer_tokens = self.load_consumer_tokens()
+        self.consumer_last_seen = {} # consumer name -> time of its last request
         
         self.get_initial_advancement_messages()
         self.configure_cron_job(self.server_props["update_interval_seconds"])
@@ -196,6 +503,21 @@ class MinecraftConnectorServer:
                 raise ValueError(msg)
         return props
 
+    '''
+    Map auth tokens to the names of the consumers reading messages
+      The auth_token property belongs to the "default" consumer, and further consumers (E.G. a staging bot or
+      a dashboard) are listed as "consumers": {"name": {"auth_token": "..."}}, each with its own read cursor
+    '''
+    def load_consumer_tokens(self) -> dict:
+        tokens = {self.server_props["auth_token"]: "default"}
+        for name, consumer_props in self.server_props.get("consumers", {}).items():
+            if consumer_props["auth_token"] in tokens:
+                msg = f"Minecraft connector consumer {name} reuses the auth token of consumer {tokens[consumer_props['auth_token']]}"
+                self.logger.error(msg)
+                raise ValueError(msg)
+            tokens[consumer_props["auth_token"]] = name
+        return tokens
+
     '''
     Load player names from whitelist JSON file to map UUIDs to names in advancement messages
     '''
@@ -210,138 +532,407 @@ class MinecraftConnectorServer:
         else:
             self.logger.warning(f"Whitelist file not found at {whitelist_path}, player names will not be resolved")
             return {}
+
+    '''
+    Reload player names only when the whitelist file has changed since it was last loaded
+    '''
+    def refresh_player_names(self):
+        whitelist_path = os.path.join(self.server_props["minecraft_home"], "whitelist.json")
+        signature = stat_signature(whitelist_path)
+        if signature == self.whitelist_signature:
+            return
+        try:
+            self.player_names = self.load_player_names()
+        except ValueError as e:
+            # The server may be in the middle of rewriting the file, so retry on the next tick
+            self.logger.warning(f"Could not parse whitelist at {whitelist_path}, keeping previous player names: {e}")
+            return
+        self.whitelist_signature = signature
+
+    def get_advancements_dir(self) -> str:
+        return os.path.join(self.server_props["minecraft_home"], self.server_props["minecraft_world_name"], "advancements")
+
+    '''
+    List the player advancement files along with their stat signatures, without reading them
+    '''
+    def scan_advancement_files(self) -> dict:
+        signatures = {}
+        with os.scandir(self.get_advancements_dir()) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    signatures[entry.name[:-5]] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return signatures
     
     '''
-    Load the list of advancements achieved by a player from their advancements JSON file
+    Create the worker pool used to parse advancement files, or None to parse them on the calling thread
+      parse_workers: number of workers, 1 (the default) disables the pool
+      parse_executor: "thread" (the default) for overlapping file I/O, or "process" to also spread the parsing across cores
+    '''
+    def create_parse_executor(self):
+        workers = self.parse_workers = self.server_props.get("parse_workers", 1)
+        if workers <= 1:
+            return None
+        if self.server_props.get("parse_executor", "thread") == "process":
+            self.logger.info(f"Parsing advancement files with {workers} worker processes")
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.logger.info(f"Parsing advancement files with {workers} worker threads")
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="advancement-parser")
+
     '''
-    def get_advancement_list(self, player_uuid: str) -> list:
-        advancements_path = os.path.join(self.server_props["minecraft_home"], self.server_props["minecraft_world_name"], "advancements", f"{player_uuid}.json")
-        announcement_whitelist = set(first_time_announcements).union(set(always_announcements))
-        if os.path.exists(advancements_path):
-            with open(advancements_path, 'r') as f:
-                data = json.load(f)
-                return [k for k in data if k in announcement_whitelist and data[k].get("done", False)]
+    Parse the advancement files of the given players, fanning out over the worker pool if there is one
+    Returns {player UUID: result of parse_advancement_file} in the same order as player_uuids
+    '''
+    def parse_advancement_files(self, player_uuids: list) -> dict:
+        advancements_dir = self.get_advancements_dir()
+        paths = [os.path.join(advancements_dir, f"{player_uuid}.json") for player_uuid in player_uuids]
+        if self.parse_executor is None or len(paths) < 2:
+            results = map(parse_advancement_file, paths)
         else:
-            self.logger.warning(f"Advancement file not found for player {player_uuid} at {advancements_path}")
-            return []
+            chunksize = max(1, len(paths) // (self.parse_workers * 4))
+            results = self.parse_executor.map(parse_advancement_file, paths, chunksize=chunksize)
+        return dict(zip(player_uuids, results))
 
     '''
     Initialize data structures for storing advancement messages
     The baseline set of messages is established at startup to avoid reporting old messages
     '''
     def get_initial_advancement_messages(self):
-        self.msg_mutex = threading.Lock()
-        self.messages = queue.Queue()
-        self.player_advancements = {}
+        self.message_log = MessageLog(
+            self.logger,
+            self.server_props.get("message_log_path", "minecraft_connector_messages.jsonl"),
+            consumers=list(self.consumer_tokens.values()),
+            max_entries=self.server_props.get("max_buffered_messages", 1000)
+        )
+        registry.gauge("minecraft_connector_consumer_lag", "Messages queued after each consumer's acknowledged cursor",
+                       lambda: {consumer: stats["lag"] for consumer, stats in self.message_log.get_consumer_stats().items()}, labelname="consumer")
+        self.player_advancements = {} # player UUID -> mask of announced advancements they have made
         self.player_names = {}
-        self.already_achieved = set()
+        self.already_achieved = 0     # mask of announced advancements made by any player
+        self.file_signatures = {}      # player UUID -> (mtime_ns, size, inode) of the advancement file when last parsed
+        self.whitelist_signature = ()  # Never matches a real signature, so the first tick always loads the whitelist
+        self.pending_baseline = set()  # players whose file could not be parsed at startup, baselined on first successful parse
+        self.snapshot_path = self.server_props.get("snapshot_path", "minecraft_connector_snapshot.json")
+        self.snapshot_interval_seconds = self.server_props.get("snapshot_interval_seconds", 60)
+        self.snapshot_dirty = False
+        self.last_snapshot_time = 0
 
         # Populate initial advancement lists for all players by reading advancements files, and store player names from whitelist
-        advancements_dir = os.path.join(self.server_props["minecraft_home"], self.server_props["minecraft_world_name"], "advancements")
+        # Players whose files are unchanged since the last snapshot are restored from it instead of being parsed again
+        advancements_dir = self.get_advancements_dir()
         if os.path.exists(advancements_dir):
-            for filename in os.listdir(advancements_dir):
-                if filename.endswith(".json"):
-                    player_uuid = filename[:-5]
-                    self.player_advancements[player_uuid] = set(self.get_advancement_list(player_uuid))
-                    self.already_achieved.update(self.player_advancements[player_uuid])
+            snapshot = self.load_snapshot()
+            signatures = self.scan_advancement_files()
+            to_parse = []
+            for player_uuid, signature in signatures.items():
+                saved = snapshot.get(player_uuid)
+                if saved is not None and saved[0] == signature:
+                    self.player_advancements[player_uuid] = saved[1]
+                    self.file_signatures[player_uuid] = signature
+                    self.already_achieved |= saved[1]
+                else:
+                    to_parse.append(player_uuid)
+            self.logger.info(f"Restored {len(self.player_advancements)} players from snapshot, parsing {len(to_parse)} changed or new advancement files")
+
+            for player_uuid, result in self.parse_advancement_files(sorted(to_parse)).items():
+                if result is None:
+                    continue
+                if isinstance(result, ValueError):
+                    self.logger.warning(f"Could not parse advancements for player {player_uuid}, will baseline on a later tick: {result}")
+                    self.pending_baseline.add(player_uuid)
+                    continue
+                self.player_advancements[player_uuid] = result
+                self.file_signatures[player_uuid] = signatures[player_uuid]
+                self.already_achieved |= self.player_advancements[player_uuid]
+            self.snapshot_dirty = len(to_parse) > 0 or len(snapshot) != len(self.player_advancements)
         else:
             self.logger.warning(f"Advancements directory not found at {advancements_dir}, no baseline will be established and all advancements will be reported as new on startup")
-        self.logger.info(f"Initial advancement messages established, {len(self.already_achieved)} advancements already achieved by players at startup")
+        self.logger.info(f"Initial advancement messages established, {self.already_achieved.bit_count()} advancements already achieved by players at startup")
 
         self.get_new_advancement_messages()
 
+    '''
+    Load the baseline snapshot written by a previous run, as {player UUID: (stat signature, advancement mask)}
+    The snapshot is ignored if it is from another format version, another world, or different announcement tables
+    '''
+    def load_snapshot(self) -> dict:
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not read advancement snapshot at {self.snapshot_path}, doing a full baseline: {e}")
+            return {}
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("advancements_dir") != self.get_advancements_dir() or snapshot.get("announcements") != announcement_ids:
+            self.logger.info(f"Advancement snapshot at {self.snapshot_path} does not match this server, doing a full baseline")
+            return {}
+        return {player_uuid: (tuple(entry[:3]), entry[3]) for player_uuid, entry in snapshot["players"].items()}
+
+    '''
+    Atomically write the current baseline to the snapshot file
+    '''
+    def save_snapshot(self):
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "advancements_dir": self.get_advancements_dir(),
+            "announcements": announcement_ids,
+            "players": {
+                player_uuid: [*signature, self.player_advancements[player_uuid]]
+                for player_uuid, signature in self.file_signatures.items() if player_uuid in self.player_advancements
+            }
+        }
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            self.logger.warning(f"Could not write advancement snapshot to {self.snapshot_path}: {e}")
+            return
+        self.snapshot_dirty = False
+        self.last_snapshot_time = time.monotonic()
+        self.logger.debug(f"Wrote advancement snapshot for {len(snapshot['players'])} players")
+
     '''
     Configure a cron job to periodically fetch new advancement messages from the world files
+      With advancement_watch_mode set to "inotify", the advancements directory is watched instead
+      and only the players whose files were written are diffed, falling back to polling if inotify is unavailable
     '''
     def configure_cron_job(self, interval_seconds: int):
-        def run_periodically():
-            while True:
-                time.sleep(interval_seconds)
-                self.get_new_advancement_messages()
-        thread = threading.Thread(target=run_periodically, daemon=True)
+        if self.server_props.get("advancement_watch_mode", "poll") == "inotify":
+            try:
+                watcher = InotifyWatcher(self.get_advancements_dir())
+            except OSError as e:
+                self.logger.warning(f"Could not watch advancements directory with inotify, falling back to polling: {e}")
+            else:
+                debounce_seconds = self.server_props.get("watch_debounce_seconds", 1)
+                resync_seconds = self.server_props.get("watch_resync_seconds", 300)
+                thread = threading.Thread(target=self.run_watcher, args=(watcher, debounce_seconds, resync_seconds, interval_seconds), daemon=True)
+                thread.start()
+                self.logger.info(f"Started inotify watcher on advancements directory with {debounce_seconds}s debounce")
+                return
+
+        thread = threading.Thread(target=self.run_polling, args=(interval_seconds,), daemon=True)
         thread.start()
         self.logger.info(f"Started background cron job with {interval_seconds}s interval")
 
+    def run_polling(self, interval_seconds: int):
+        while True:
+            time.sleep(interval_seconds)
+            self.get_new_advancement_messages()
+
+    '''
+    Event loop for inotify mode
+      Bursts of writes are debounced so a player is diffed once per save, even if several files are touched
+      A full scan still runs every resync_seconds, and after an event queue overflow, to catch anything missed
+      If the directory stops being watchable, E.G. it was deleted, this falls back to polling
+    '''
+    def run_watcher(self, watcher: InotifyWatcher, debounce_seconds: float, resync_seconds: float, interval_seconds: int):
+        last_full_scan = time.monotonic()
+        while True:
+            events = watcher.read_events(resync_seconds - (time.monotonic() - last_full_scan))
+            if not events:
+                self.get_new_advancement_messages()
+                last_full_scan = time.monotonic()
+                continue
+
+            touched = set()
+            full_scan = False
+            deadline = time.monotonic() + debounce_seconds * 5
+            while events:
+                for name, mask in events:
+                    if mask & IN_IGNORED:
+                        self.logger.warning("Advancements directory is no longer watched, falling back to polling")
+                        watcher.close()
+                        self.get_new_advancement_messages()
+                        self.run_polling(interval_seconds)
+                        return
+                    if mask & IN_Q_OVERFLOW:
+                        full_scan = True
+                    elif name.endswith(".json"):
+                        touched.add(name[:-5])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                events = watcher.read_events(min(debounce_seconds, remaining))
+
+            if full_scan:
+                self.get_new_advancement_messages()
+                last_full_scan = time.monotonic()
+            elif touched:
+                self.get_new_advancement_messages(touched)
+
     '''
     Worker function for the cron job to to update the advancement message list
     with new messages from the Minecraft world files
+      Only files whose stat signature changed since they were last parsed are read
+      player_uuids limits the check to those players' files, otherwise the whole directory is scanned
     '''
-    def get_new_advancement_messages(self):
-        self.player_names = self.load_player_names()
-        advancements_dir = os.path.join(self.server_props["minecraft_home"], self.server_props["minecraft_world_name"], "advancements")
+    def get_new_advancement_messages(self, player_uuids: set = None):
+        start = time.perf_counter()
+        self.refresh_player_names()
+        advancements_dir = self.get_advancements_dir()
         if os.path.exists(advancements_dir):
-            for filename in os.listdir(advancements_dir):
-                if filename.endswith(".json"):
-
-                    # Get list of new advancements for this player by comparing current advancements in file to previously stored advancements
-                    player_uuid = filename[:-5]
-                    player_name = self.player_names.get(player_uuid, player_uuid)
-                    current_advancements = set(self.get_advancement_list(player_uuid))
-                    previous_advancements = set(self.player_advancements.get(player_uuid, set()))
-                    new_advancements = current_advancements - previous_advancements
-
-                    self.logger.debug(f"Player {player_name} has {len(new_advancements)} new advancements since last check")
-
-                    # Create messages for any new advancements and add them to the queue, then update stored advancements for this player
-                    for adv in new_advancements:
-                        first_or_not_text = "is the first player to make"
-                        if adv in first_time_announcements:
-                            if adv not in self.already_achieved:
-                                self.msg_mutex.acquire()
-                                try:
-                                    msg = f"{player_name} {first_or_not_text} the advancement **[{first_time_announcements[adv]}]**"
-                                    self.logger.info(f"Queuing new advancement message: {msg}")
-                                    self.messages.put(msg)
-                                finally:
-                                    self.msg_mutex.release()
-                                self.already_achieved.add(adv)
-                        elif adv in always_announcements:
-                            if adv in self.already_achieved:
-                                first_or_not_text = "has made"
-                            self.msg_mutex.acquire()
-                            try:
-                                msg = f"{player_name} {first_or_not_text} the advancement **[{always_announcements[adv]}]**"
-                                self.logger.info(f"Queuing new advancement message: {msg}")
-                                self.messages.put(msg)
-                            finally:
-                                self.msg_mutex.release()
-                            self.already_achieved.add(adv)
-                        else:
-                            self.logger.warning(f"Advancement {adv} is not in either announcement list, skipping")
+            if player_uuids is None:
+                current_signatures = self.scan_advancement_files()
+                for player_uuid in self.file_signatures.keys() - current_signatures.keys():
+                    del self.file_signatures[player_uuid]
+                    self.snapshot_dirty = True
+            else:
+                current_signatures = {}
+                for player_uuid in player_uuids:
+                    signature = stat_signature(os.path.join(advancements_dir, f"{player_uuid}.json"))
+                    if signature is not None:
+                        current_signatures[player_uuid] = signature
+
+            # Players are merged in order of when their file was written, so whoever saved first is announced first
+            changed = [u for u, signature in current_signatures.items() if self.file_signatures.get(u) != signature]
+            changed.sort(key=lambda u: (current_signatures[u][0], u))
+            for player_uuid, current_advancements in self.parse_advancement_files(changed).items():
+                if current_advancements is None:
+                    self.logger.debug(f"Advancement file for player {player_uuid} disappeared before it could be read")
+                    continue
+                if isinstance(current_advancements, ValueError):
+                    self.logger.warning(f"Could not parse advancements for player {player_uuid}, retrying on the next tick: {current_advancements}")
+                    continue
+                self.file_signatures[player_uuid] = current_signatures[player_uuid]
+                if player_uuid in self.pending_baseline:
+                    self.pending_baseline.discard(player_uuid)
                     self.player_advancements[player_uuid] = current_advancements
+                    self.already_achieved |= current_advancements
+                    continue
+                self.queue_new_advancement_messages(player_uuid, current_advancements)
+            self.logger.debug(f"Scanned {len(current_signatures)} advancement files, {len(changed)} changed since last check")
+            files_scanned.inc(len(current_signatures))
+            files_parsed.inc(len(changed))
+            if changed:
+                self.snapshot_dirty = True
+            if self.snapshot_dirty and time.monotonic() - self.last_snapshot_time >= self.snapshot_interval_seconds:
+                self.save_snapshot()
         else:
             self.logger.warning(f"Advancements directory not found at {advancements_dir}, no messages will be generated")
+        tick_seconds.observe(time.perf_counter() - start)
+
+    '''
+    Compare a player's current advancements to the previously stored ones, queue messages for
+    any new ones that should be announced, then update the stored advancements for this player
+    '''
+    def queue_new_advancement_messages(self, player_uuid: str, current_advancements: int):
+        player_name = self.player_names.get(player_uuid, player_uuid)
+        new_advancements = current_advancements & ~self.player_advancements.get(player_uuid, 0)
+
+        self.logger.debug(f"Player {player_name} has {new_advancements.bit_count()} new advancements since last check")
+
+        # First-time advancements are only announced if nobody has made them yet, always-announced ones every time
+        announced = (new_advancements & first_time_mask & ~self.already_achieved) | (new_advancements & always_mask)
+        for adv in mask_to_advancements(announced):
+            if adv in first_time_announcements:
+                msg = f"{player_name} is the first player to make the advancement **[{first_time_announcements[adv]}]**"
+            elif announcement_bits[adv] & self.already_achieved:
+                msg = f"{player_name} has made the advancement **[{always_announcements[adv]}]**"
+            else:
+                msg = f"{player_name} is the first player to make the advancement **[{always_announcements[adv]}]**"
+            self.logger.info(f"Queuing new advancement message: {msg}")
+            self.message_log.append(msg)
+            messages_queued.inc()
+        self.already_achieved |= new_advancements
+        self.player_advancements[player_uuid] = current_advancements
     
     '''
     Setup Flask routes for the HTTP server
-      messages: GET - fetch all queued advancement messages
+      Every route requires the auth token of one of the consumers, and works on that consumer's read cursor
+      messages: GET - fetch queued advancement messages
+        after: return messages with a sequence number greater than this, without consuming them
+               if omitted, unacknowledged messages are returned and acknowledged immediately (at-most-once delivery)
+        wait: optional number of seconds to hold the request open until a message is queued (long poll),
+              capped by the max_long_poll_seconds server property
+      ack: POST {"seq": n} - acknowledge delivery of every message up to and including n
+      cursor: GET - the sequence number of the last acknowledged message, where a restarted client should resume
+      consumers: GET - delivery state of every consumer, to spot ones that are falling behind
+      metrics: GET - scan and delivery metrics in the Prometheus text format
     '''
     def setup_routes(self):
 
+        def authenticate():
+            consumer = self.consumer_tokens.get(flask.request.headers.get("Authorization"))
+            if consumer is not None:
+                self.consumer_last_seen[consumer] = time.time()
+            return consumer
+
         @self.app.route("/messages", methods=["GET"])
         def get_messages():
-            auth_header = flask.request.headers.get("Authorization")
-            if auth_header != self.server_props["auth_token"]:
+            consumer = authenticate()
+            if consumer is None:
                 return flask.jsonify({"error": "Unauthorized"}), 401
             
-            messages = self.fetch_messages()
-            return flask.jsonify({"messages": messages})
+            wait_seconds = max(0, min(flask.request.args.get("wait", 0, type=float), self.server_props.get("max_long_poll_seconds", 30)))
+            after = flask.request.args.get("after", None, type=int)
+            entries = self.fetch_messages(wait_seconds, after, consumer)
+            return flask.jsonify({
+                "messages": [text for _, text in entries],
+                "entries": [{"seq": seq, "text": text} for seq, text in entries],
+                "last_seq": self.message_log.get_last_seq(),
+                # Only a request that was held open lets the client poll again right away
+                "long_poll": wait_seconds > 0
+            })
+
+        @self.app.route("/ack", methods=["POST"])
+        def ack_messages():
+            consumer = authenticate()
+            if consumer is None:
+                return flask.jsonify({"error": "Unauthorized"}), 401
+            seq = (flask.request.get_json(silent=True) or {}).get("seq")
+            if not isinstance(seq, int):
+                return flask.jsonify({"error": "Expected a JSON body with an integer seq"}), 400
+            self.message_log.ack(seq, consumer)
+            return flask.jsonify({"acked_seq": self.message_log.get_acked_seq(consumer)})
+
+        @self.app.route("/cursor", methods=["GET"])
+        def get_cursor():
+            consumer = authenticate()
+            if consumer is None:
+                return flask.jsonify({"error": "Unauthorized"}), 401
+            return flask.jsonify({"acked_seq": self.message_log.get_acked_seq(consumer)})
+
+        @self.app.route("/consumers", methods=["GET"])
+        def get_consumers():
+            if authenticate() is None:
+                return flask.jsonify({"error": "Unauthorized"}), 401
+            return flask.jsonify({"consumers": self.get_consumer_stats()})
+
+        @self.app.route("/metrics", methods=["GET"])
+        def get_metrics():
+            if authenticate() is None:
+                return flask.jsonify({"error": "Unauthorized"}), 401
+            return flask.Response(registry.render(), headers={"Content-Type": CONTENT_TYPE})
 
     '''
-    Helper to fetch and return all queued advancement messages in a threadsafe manner
+    Helper to fetch queued advancement messages for a consumer as (seq, text) pairs in a threadsafe manner
+    If there are none, waits up to wait_seconds for a message to be queued before returning
+    Without an after cursor, the returned messages are acknowledged immediately
     '''
-    def fetch_messages(self):
-        messages = []
-        self.msg_mutex.acquire()
-        try:
-            while not self.messages.empty():
-                try:
-                    messages.append(self.messages.get_nowait())
-                except queue.Empty:
-                    break
-        finally:
-            self.msg_mutex.release()
-        return messages
+    def fetch_messages(self, wait_seconds: float = 0, after: int = None, consumer: str = "default") -> list:
+        if after is not None:
+            return self.message_log.read_after(after, wait_seconds)
+        entries = self.message_log.read_after(self.message_log.get_acked_seq(consumer), wait_seconds)
+        if entries:
+            self.message_log.ack(entries[-1][0], consumer)
+        return entries
+
+    '''
+    Delivery state of every consumer, with the time since its last request, or None if it has not connected yet
+    '''
+    def get_consumer_stats(self) -> dict:
+        stats = self.message_log.get_consumer_stats()
+        now = time.time()
+        for consumer, consumer_stats in stats.items():
+            last_seen = self.consumer_last_seen.get(consumer)
+            consumer_stats["seconds_since_seen"] = None if last_seen is None else round(now - last_seen, 1)
+        return stats
 
 #===================================================================================
 ####   Server entry point   ########################################################
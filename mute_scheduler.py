@@ -0,0 +1,129 @@
+import os, json, time, heapq, asyncio
+from logging import Logger
+
+class MuteScheduler:
+    '''
+    Pending unmutes, run by a single timer task over a min-heap of due times
+      Every change is written to a small JSON store, so pending unmutes survive a restart and are reloaded by start()
+      Only one unmute is pending per member, muting someone again replaces it
+      Heap entries are not removed on cancel or reschedule, stale ones are skipped when they come due
+      on_due: async (pending unmute dict), called when an unmute is due, if it raises the unmute is retried later
+    '''
+    def __init__(self, logger: Logger, on_due, path: str = "pending_unmutes.json", retry_seconds: float = 60):
+        self.logger = logger
+        self.on_due = on_due
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.pending = {}  # "guild ID:member ID" -> {"guild_id", "member_id", "member_name", "moderator_name", "due_at"}
+        self.heap = []     # (due_at, key)
+        self.changed = None
+        self.task = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not read pending unmutes from {self.path}: {e}")
+            return
+        for entry in entries:
+            key = f"{entry['guild_id']}:{entry['member_id']}"
+            self.pending[key] = entry
+            heapq.heappush(self.heap, (entry["due_at"], key))
+        self.logger.info(f"Loaded {len(self.pending)} pending unmutes from {self.path}")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.pending.values()), f)
+        os.replace(tmp_path, self.path)
+
+    async def start(self):
+        if self.task is None:
+            self.changed = asyncio.Event()
+            self.load()
+            self.task = asyncio.create_task(self.run(), name="mute-scheduler")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def schedule(self, guild_id: int, member_id: int, member_name: str, moderator_name: str, minutes: int) -> dict:
+        key = f"{guild_id}:{member_id}"
+        entry = {
+            "guild_id": guild_id,
+            "member_id": member_id,
+            "member_name": member_name,
+            "moderator_name": moderator_name,
+            "due_at": time.time() + minutes * 60
+        }
+        self.pending[key] = entry
+        heapq.heappush(self.heap, (entry["due_at"], key))
+        self.save()
+        self.wake()
+        return entry
+
+    '''
+    Remove a member's pending unmute without running it, returning it, or None if there was none
+    '''
+    def get(self, guild_id: int, member_id: int) -> dict:
+        return self.pending.get(f"{guild_id}:{member_id}")
+
+    def cancel(self, guild_id: int, member_id: int) -> dict:
+        entry = self.pending.pop(f"{guild_id}:{member_id}", None)
+        if entry is not None:
+            self.save()
+        return entry
+
+    '''
+    Pending unmutes in a guild, soonest first
+    '''
+    def list_pending(self, guild_id: int) -> list:
+        return sorted((entry for entry in self.pending.values() if entry["guild_id"] == guild_id), key=lambda entry: entry["due_at"])
+
+    def wake(self):
+        if self.changed is not None:
+            self.changed.set()
+
+    async def run(self):
+        while True:
+            # Drop heap entries that were cancelled or replaced by a later mute
+            while self.heap and self.pending.get(self.heap[0][1], {}).get("due_at") != self.heap[0][0]:
+                heapq.heappop(self.heap)
+
+            self.changed.clear()
+            if not self.heap:
+                await self.changed.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, key = heapq.heappop(self.heap)
+            entry = self.pending[key]
+            try:
+                await self.on_due(entry)
+            except asyncio.CancelledError:
+                heapq.heappush(self.heap, (entry["due_at"], key))
+                raise
+            except Exception as e:
+                self.logger.error(f"Failed to unmute {entry['member_name']}, retrying in {self.retry_seconds}s: {e!r}")
+                entry["due_at"] = time.time() + self.retry_seconds
+                heapq.heappush(self.heap, (entry["due_at"], key))
+                self.save()
+                continue
+            # The member may have been muted again while on_due was running
+            if self.pending.get(key) is entry:
+                del self.pending[key]
+                self.save()
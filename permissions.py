@@ -0,0 +1,128 @@
+import discord
+from enum import IntFlag
+from logging import Logger
+
+#===================================================================================
+#=== Server configuration ==========================================================
+#===================================================================================
+
+# Role and channel IDs
+ROLE_IDS = {
+    "mod": 803579561362063390,
+    "jari": 566355710670012533,
+    "commodore": 1183790559324807258,
+
+    # Age roles
+    "ss": 705783318246850812,
+    "dd": 703260124621570074,
+    "cl": 703259878206078976,
+    "cv": 703259629018284092,
+    "bb": 717611783614890006
+}
+LOG_CHANNEL_ID = 638208991587205120
+
+# Commodore color roles
+COLOR_ROLES = {
+    "grey": 1216455609709363281,
+    "purple": 1216455321396973598,
+    "yellow": 1216454050912931981,
+    "red": 1216454500425007307,
+    "cyan": 1216454226650206258,
+    "blue": 1216454278613307563,
+    "green": 1216454315015671808,
+    "pink" : 1526963750035390555
+}
+
+BOT_ADMINS = [
+    188646158636285952, # crocdent
+    202142045114990592  # goldensunboy
+]
+
+#===================================================================================
+#=== Capabilities ==================================================================
+#===================================================================================
+
+class Capability(IntFlag):
+    NONE = 0
+    MODERATOR = 1
+    COMMODORE = 2
+    AGE_ADULT = 4  # CL, CV or BB age role
+    AGE_MINOR = 8  # SS or DD age role
+    BOT_ADMIN = 16
+
+# Capabilities granted by holding a role
+ROLE_CAPABILITIES = {
+    ROLE_IDS["mod"]: Capability.MODERATOR,
+    ROLE_IDS["commodore"]: Capability.COMMODORE,
+    ROLE_IDS["cl"]: Capability.AGE_ADULT,
+    ROLE_IDS["cv"]: Capability.AGE_ADULT,
+    ROLE_IDS["bb"]: Capability.AGE_ADULT,
+    ROLE_IDS["ss"]: Capability.AGE_MINOR,
+    ROLE_IDS["dd"]: Capability.AGE_MINOR
+}
+
+# Capabilities granted to specific users, wherever they invoke the bot
+USER_CAPABILITIES = {user_id: Capability.BOT_ADMIN for user_id in BOT_ADMINS}
+
+# Capabilities granted by the server's administrator permission
+ADMINISTRATOR_CAPABILITIES = Capability.MODERATOR
+
+# Commands that need a capability, and what to tell users who lack it
+# New commands plug in here, LoggingWrapper enforces this before a command runs
+NOT_ALLOWED = "Sorry Shikikan, but you aren't allowed to use this command."
+COMMAND_CAPABILITIES = {
+    "mute": (Capability.MODERATOR, NOT_ALLOWED),
+    "mutes": (Capability.MODERATOR, NOT_ALLOWED),
+    "unmute": (Capability.MODERATOR, NOT_ALLOWED),
+    "color": (Capability.COMMODORE, "Sorry Shikikan, but only Commodore can change color."),
+    "host": (Capability.BOT_ADMIN, NOT_ALLOWED),
+    "export": (Capability.MODERATOR, NOT_ALLOWED)
+}
+
+class PermissionResolver:
+    '''
+    Resolves members to a Capability mask, computed once per member and cached
+      The cache must be invalidated when a member's roles change, and for a whole guild when its roles change
+      Users outside a guild, E.G. in DMs, only get their user capabilities
+    '''
+    def __init__(self, logger: Logger, role_capabilities: dict = ROLE_CAPABILITIES, user_capabilities: dict = USER_CAPABILITIES,
+                 command_capabilities: dict = COMMAND_CAPABILITIES):
+        self.logger = logger
+        self.role_capabilities = role_capabilities
+        self.user_capabilities = user_capabilities
+        self.command_capabilities = command_capabilities
+        self.cache = {} # (guild ID or None, user ID) -> Capability
+
+    def get(self, user) -> Capability:
+        guild = getattr(user, "guild", None)
+        key = (guild.id if guild is not None else None, user.id)
+        capabilities = self.cache.get(key)
+        if capabilities is None:
+            capabilities = self.user_capabilities.get(user.id, Capability.NONE)
+            if isinstance(user, discord.Member):
+                for role in user.roles:
+                    capabilities |= self.role_capabilities.get(role.id, Capability.NONE)
+                if user.guild_permissions.administrator:
+                    capabilities |= ADMINISTRATOR_CAPABILITIES
+            self.cache[key] = capabilities
+        return capabilities
+
+    def has(self, user, capability: Capability) -> bool:
+        return self.get(user) & capability == capability
+
+    '''
+    Return the message to send if the user may not run a command, or None if they may
+    '''
+    def check_command(self, user, command_name: str) -> str:
+        required = self.command_capabilities.get(command_name)
+        if required is None or self.has(user, required[0]):
+            return None
+        return required[1]
+
+    def invalidate_member(self, guild_id: int, member_id: int):
+        self.cache.pop((guild_id, member_id), None)
+
+    def invalidate_guild(self, guild_id: int):
+        for key in [key for key in self.cache if key[0] == guild_id]:
+            del self.cache[key]
+        self.logger.debug(f"Invalidated cached permissions for guild ID {guild_id}")
@@ -0,0 +1,88 @@
+import discord, asyncio
+from logging import Logger
+from ttl_cache import TTLCache
+
+class PendingRoleEdit:
+    def __init__(self, member: discord.Member):
+        self.member = member
+        self.changes = {}  # role ID -> True to add, False to remove, later requests win
+        self.reasons = []
+        self.futures = []  # resolved once the edit carrying these changes has been applied
+
+class RoleMutator:
+    '''
+    Applies role changes as a single member edit that sets the member's whole role list
+      Changes requested for the same member while an edit is being prepared are merged into it, so a burst
+      of commands costs one API call, and no call is made at all if the member already has the target roles
+      Rate limit buckets are handled by discord.py's HTTP client, this only keeps the number of calls down
+    '''
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.pending = {}  # (guild ID, member ID) -> PendingRoleEdit not yet sent
+        self.locks = {}    # (guild ID, member ID) -> lock held while an edit for that member is in flight
+        # (guild ID, member ID) -> (role IDs before, role IDs after) of the last edit, until the gateway reports it
+        self.recent_edits = TTLCache(max_entries=1024, ttl_seconds=60)
+        self.api_calls = 0
+
+    '''
+    Add and remove roles (Role objects or IDs) for a member, returning once the change has been applied
+    A role in both add and remove is added
+    '''
+    async def edit_roles(self, member: discord.Member, add=(), remove=(), reason: str = None):
+        key = (member.guild.id, member.id)
+        edit = self.pending.get(key)
+        if edit is None:
+            edit = self.pending[key] = PendingRoleEdit(member)
+        for role in remove:
+            edit.changes[getattr(role, "id", role)] = False
+        for role in add:
+            edit.changes[getattr(role, "id", role)] = True
+        if reason is not None:
+            edit.reasons.append(reason)
+        future = asyncio.get_running_loop().create_future()
+        edit.futures.append(future)
+
+        # The first caller for a batch sends it, everyone else waits for the result
+        if len(edit.futures) == 1:
+            asyncio.create_task(self.flush(key))
+        await future
+
+    async def flush(self, key: tuple):
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Let callers in the same burst add their changes before the batch is taken
+            await asyncio.sleep(0)
+            edit = self.pending.pop(key)
+            try:
+                await self.apply(edit)
+            except Exception as e:
+                for future in edit.futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in edit.futures:
+                    if not future.done():
+                        future.set_result(None)
+        if not lock.locked() and key not in self.pending:
+            self.locks.pop(key, None)
+
+    '''
+    Send the edit if it changes anything
+    '''
+    async def apply(self, edit: PendingRoleEdit):
+        # Prefer the gateway's copy of the member, which reflects edits made since the command started
+        member = edit.member.guild.get_member(edit.member.id) or edit.member
+        key = (member.guild.id, member.id)
+        default_role_id = member.guild.default_role.id
+        current = {role.id for role in member.roles if role.id != default_role_id}
+        recent = self.recent_edits.get(key)
+        if recent is not None and recent[0] == current:
+            current = recent[1] # The member update event for our previous edit has not arrived yet
+        target = {role_id for role_id in current if edit.changes.get(role_id, True)}
+        target |= {role_id for role_id, added in edit.changes.items() if added and role_id != default_role_id}
+        if target == current:
+            self.logger.debug(f"Roles for {member.name} are already up to date, skipping edit")
+            return
+        self.api_calls += 1
+        await member.edit(roles=[discord.Object(id=role_id) for role_id in target], reason="; ".join(edit.reasons) or None)
+        self.recent_edits.put(key, ({role.id for role in member.roles if role.id != default_role_id}, target))
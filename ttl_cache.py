@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    '''
+    Bounded in-memory cache with least-recently-used eviction and a per-entry time to live
+      Not threadsafe, meant to be used from the bot's event loop
+    '''
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # key -> (value, expiry time), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if time.monotonic() >= expires_at:
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Replace the value only if the key is still cached, keeping its original expiry
+    def update(self, key, value):
+        item = self.entries.get(key)
+        if item is not None:
+            self.entries[key] = (value, item[1])
+
+    def pop(self, key, default=None):
+        item = self.entries.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key) -> bool:
+        item = self.entries.get(key)
+        return item is not None and time.monotonic() < item[1]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()